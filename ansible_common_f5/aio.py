@@ -0,0 +1,412 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio variant of the F5 clients and objects
+
+This module requires Python 3.5+ and aiohttp. The objects keep the params and the comparison of their synchronous
+counterparts, but talk to the iControl REST API directly instead of through the f5-sdk: any class inheriting from
+them sets the path of its resources (eg '/mgmt/tm/ltm/pool').
+"""
+
+import asyncio
+import json
+import socket
+import time
+import weakref
+
+from ansible.module_utils.six import iteritems
+from requests.exceptions import HTTPError
+
+from ansible_common_f5.base import AnsibleF5Error, F5_PROVIDER_ARGS, F5_TOKEN_DEFAULT_TIMEOUT, F5NamedBaseObject, \
+    F5RetryPolicy, F5UnnamedBaseObject
+
+# Make sure aiohttp is installed on the host
+try:
+    import aiohttp
+
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+
+class F5AsyncResponse(object):
+    """Response of the iControl REST API attached to its errors (as expected by F5RetryPolicy)"""
+
+    def __init__(self, status_code, reason, headers, text):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
+
+
+class F5AsyncHTTPError(HTTPError):
+    """Error response of the iControl REST API"""
+    pass
+
+
+class F5AsyncResource(object):
+    """Resource loaded from the iControl REST API, with the keys of its JSON representation as attributes"""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+
+class F5AsyncClient(object):
+    """Base class for all F5 asynchronous clients
+
+    It provides an asynchronous interface to a single F5 system. The number of concurrent connections to the system
+    is limited by max_connections.
+
+    Clients are pooled per event loop and keyed by provider (see for_provider).
+    """
+
+    # Login provider used to request an authentication token (None for basic authentication)
+    _token_type = None
+
+    # Pool of clients of each event loop, dropped with their loop
+    _clients = weakref.WeakKeyDictionary()
+    # Generators closing the clients of the running loops at their shutdown
+    _closers = []
+
+    def __init__(self, provider, max_connections=10):
+        if not HAS_AIOHTTP:
+            raise AnsibleF5Error("The python aiohttp module is required. Try 'pip install aiohttp'.")
+        self.provider = dict((k, spec.get('default')) for k, spec in iteritems(F5_PROVIDER_ARGS))
+        self.provider.update(provider)
+        self.base_url = 'https://{0}:{1}'.format(self.provider['f5_hostname'], self.provider['f5_port'])
+        self._max_connections = max_connections
+        self._retry_policy = F5RetryPolicy.from_provider(self.provider)
+        self._session = None
+        self._token = None
+        self._token_expiration = None
+        self._login_lock = None
+
+    @classmethod
+    def for_provider(cls, provider, max_connections=10):
+        """Get the pooled client of a provider for the running event loop.
+
+        The clients of a loop are closed when it shuts down its asynchronous generators (eg at the end of
+        asyncio.run), or by close_all.
+        """
+        loop = asyncio.get_event_loop()
+        clients = F5AsyncClient._clients.get(loop)
+        if clients is None:
+            clients = {}
+            F5AsyncClient._clients[loop] = clients
+            # The closers refer to their loop, drop them with it
+            F5AsyncClient._closers[:] = [(lp, closer) for lp, closer in F5AsyncClient._closers if not lp.is_closed()]
+            if loop.is_running():
+                # Started now, so that the loop closes it (and the clients) at shutdown
+                closer = _close_at_shutdown(clients)
+                F5AsyncClient._closers.append((loop, closer))
+                asyncio.ensure_future(closer.__anext__())
+
+        key = (cls.__name__, provider['f5_hostname'], provider.get('f5_port'), provider['f5_username'],
+               provider.get('f5_verify'))
+        client = clients.get(key)
+        if client is None:
+            client = cls(provider, max_connections=max_connections)
+            clients[key] = client
+        return client
+
+    @classmethod
+    async def close_all(cls):
+        """Close the pooled clients of the running event loop."""
+        clients = F5AsyncClient._clients.get(asyncio.get_event_loop())
+        if clients is not None:
+            await _close_clients(clients)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_connections,
+                                             ssl=None if self.provider['f5_verify'] else False)
+            auth = None
+            if self._token_type is None:
+                auth = aiohttp.BasicAuth(self.provider['f5_username'], self.provider['f5_password'])
+            self._session = aiohttp.ClientSession(connector=connector, auth=auth)
+        return self._session
+
+    async def _get_auth_headers(self):
+        if self._token_type is None:
+            return {}
+
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self._token is None or self._token_expiration <= time.time():
+                await self._login()
+        return {'X-F5-Auth-Token': self._token}
+
+    async def _login(self):
+        """Request a new authentication token."""
+        data = {'username': self.provider['f5_username'],
+                'password': self.provider['f5_password'],
+                'loginProviderName': self._token_type}
+        body = await self._send('POST', '/mgmt/shared/authn/login', json=data)
+        token = body['token']
+        self._token = token['token']
+        # Refresh the token a little before it expires
+        self._token_expiration = time.time() + token.get('timeout', F5_TOKEN_DEFAULT_TIMEOUT) - 60
+
+    async def _send(self, method, path, params=None, json=None, headers=None):
+        session = self._get_session()
+        async with session.request(method, self.base_url + path, params=params, json=json,
+                                   headers=headers) as response:
+            text = await response.text()
+            if response.status >= 400:
+                error_message = '{0} Unexpected Error: {1} for uri: {2}\nText: {3!r}'.format(
+                    response.status, response.reason, response.url, text)
+                raise F5AsyncHTTPError(error_message, response=F5AsyncResponse(
+                    response.status, response.reason, response.headers, text))
+            return _loads(text)
+
+    async def request(self, method, path, params=None, json=None, idempotent=True):
+        """Send a request to the iControl REST API and return the decoded response.
+
+        The transient failures are retried like the synchronous clients do (see F5RetryPolicy).
+        """
+        attempt = 0
+        while True:
+            try:
+                try:
+                    return await self._send(method, path, params, json, await self._get_auth_headers())
+                except F5AsyncHTTPError as exc:
+                    # The token expired or was revoked, log in again once
+                    if exc.response.status_code != 401 or self._token_type is None or attempt > 0:
+                        raise
+                    self._token = None
+                    return await self._send(method, path, params, json, await self._get_auth_headers())
+            except Exception as exc:
+                attempt += 1
+                if attempt >= self._retry_policy.retries or not self._is_retryable(exc, idempotent):
+                    raise
+                await asyncio.sleep(self._retry_policy.get_delay(attempt, exc))
+
+    def _is_retryable(self, exc, idempotent):
+        if isinstance(exc, HTTPError):
+            return self._retry_policy.is_retryable(exc, idempotent)
+        if isinstance(exc, aiohttp.ClientConnectorError):
+            # Nothing was sent, unless the host name cannot be resolved
+            return not isinstance(exc.os_error, socket.gaierror)
+        if isinstance(exc, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return idempotent
+        return False
+
+    async def get(self, path, params=None):
+        return await self.request('GET', path, params=params)
+
+    async def post(self, path, json=None):
+        return await self.request('POST', path, json=json, idempotent=False)
+
+    async def patch(self, path, json=None):
+        return await self.request('PATCH', path, json=json)
+
+    async def put(self, path, json=None):
+        return await self.request('PUT', path, json=json)
+
+    async def delete(self, path):
+        return await self.request('DELETE', path, idempotent=False)
+
+
+def _loads(text):
+    return json.loads(text) if text else {}
+
+
+async def _close_clients(clients):
+    pending = list(clients.values())
+    clients.clear()
+    for client in pending:
+        await client.close()
+
+
+async def _close_at_shutdown(clients):
+    try:
+        yield
+    finally:
+        await _close_clients(clients)
+
+
+class F5AsyncBigIpClient(F5AsyncClient):
+    """F5 BIG-IP asynchronous client"""
+
+    _token_type = 'tmos'
+
+
+class F5AsyncBigIqClient(F5AsyncClient):
+    """F5 BIG-IQ asynchronous client"""
+    pass
+
+
+class F5AsyncIWorkflowClient(F5AsyncClient):
+    """F5 iWorkflow asynchronous client"""
+
+    _token_type = 'local'
+
+
+class F5AsyncObjectMixin(object):
+    """Asynchronous behavior shared by the F5 named and unnamed objects
+
+    Any class inheriting from the asynchronous objects should set the path of its resources (and may set the client
+    class of its F5 system, BIG-IP by default).
+    """
+
+    _client_class = F5AsyncBigIpClient
+    _max_connections = 10
+    _path = None
+
+    def _set_crud_methods(self):
+        # The CRUD methods are the HTTP methods of the path
+        pass
+
+    @property
+    def _client(self):
+        return self._client_class.for_provider(self._provider, max_connections=self._max_connections)
+
+    @property
+    def _uri(self):
+        return self._path
+
+    async def _read(self):
+        """Load an already configured object from the F5 system."""
+        self._check_load_params()
+        obj = F5AsyncResource(await self._client.get(self._uri))
+
+        for attr, value in vars(obj).items():
+            if isinstance(value, list):
+                if all(isinstance(val, dict) for val in value):
+                    for key in value:
+                        if 'nameReference' in key:
+                            del key['nameReference']
+
+        return obj
+
+    async def _update(self):
+        """Update an object on the F5 system."""
+        # Load the object (unless already loaded by flush)
+        if self._obj is None:
+            self._obj = await self._read()
+
+        # Check params
+        self._check_update_params()
+
+        cparams = self._get_changed_params()
+        if not cparams:
+            return False
+
+        if self._check_mode:
+            return True
+
+        # The response is the updated object
+        self._obj = F5AsyncResource(await self._client.patch(self._uri, json=cparams))
+        return True
+
+
+class F5AsyncNamedBaseObject(F5AsyncObjectMixin, F5NamedBaseObject):
+    """Base abstract class for all F5 asynchronous named objects"""
+
+    @property
+    def _uri(self):
+        res_id = self._get_resource_id_from_params()
+        if 'partition' not in res_id:
+            return '{0}/{1}'.format(self._path, res_id['name'])
+        parts = [res_id['partition'], res_id.get('subPath'), res_id['name']]
+        return '{0}/~{1}'.format(self._path, '~'.join(p for p in parts if p is not None))
+
+    async def _exists(self):
+        """Check for the existence of the named object on the F5 system."""
+        return await self._load() is not None
+
+    async def _load(self):
+        """Load the named object from the F5 system, or return None if it does not exist."""
+        try:
+            return await self._read()
+        except HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 404:
+                return None
+            raise
+
+    async def _create(self):
+        """Create an object on the F5 system."""
+        # Remove empty params
+        params = dict((k, v) for k, v in iteritems(self._params) if v is not None)
+
+        # Check params
+        self._check_create_params()
+
+        if self._check_mode:
+            return True
+
+        # The response is the created object
+        self._obj = F5AsyncResource(await self._client.post(self._path, json=params))
+        return True
+
+    async def _delete(self):
+        """Delete an object on the F5 system."""
+        if self._check_mode:
+            return True
+
+        await self._client.delete(self._uri)
+        return True
+
+    async def _present(self):
+        self._obj = await self._load()
+
+        if self._obj is None:
+            has_changed = await self._create()
+        else:
+            has_changed = await self._update()
+
+        return has_changed
+
+    async def _absent(self):
+        has_changed = False
+
+        self._obj = await self._load()
+        if self._obj is not None:
+            has_changed = await self._delete()
+
+        return has_changed
+
+    async def flush(self):
+        """Send the buffered object to the F5 system, depending upon the state of the object."""
+        result = dict(changed=False)
+
+        if self._state == "present":
+            result['changed'] = await self._present()
+        elif self._state == "absent":
+            result['changed'] = await self._absent()
+
+        return result
+
+
+class F5AsyncUnnamedBaseObject(F5AsyncObjectMixin, F5UnnamedBaseObject):
+    """Base abstract class for all F5 asynchronous unnamed objects
+
+    These objects do not support create or delete.
+    """
+
+    async def flush(self):
+        """Send the buffered object to the F5 system."""
+        result = dict(changed=False)
+        self._obj = await self._read()
+        result['changed'] = await self._update()
+        return result
@@ -20,19 +20,31 @@
 This module provides utility classes to ease the interaction between Ansible and F5 systems.
 """
 
-from abc import ABCMeta, abstractmethod, abstractproperty
+import hashlib
+import json
+import logging
+import random
+import re
+import socket
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
+from functools import partial
 
-import requests
 from ansible.module_utils.six import iteritems, with_metaclass
-from deepdiff import DeepDiff
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, HTTPError, Timeout
+from requests.packages import urllib3
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-from ansible_common_f5.utils import camel_to_snake, change_dict_naming_convention, convert, missing_required_params, \
-    snake_to_camel
-
-# Disable Insecure Request Warning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from ansible_common_f5.cache import F5CapabilityCache, F5GenerationCache, F5TokenCache, get_cache_dir
+from ansible_common_f5.metrics import LOG, collect_metrics, incr, record_response, timed
+from ansible_common_f5.ratelimit import F5RateLimitedAdapter, F5RateLimiter
+from ansible_common_f5.rest import DEFAULT_PAGE_SIZE, F5TimeoutAdapter, get_base_url, get_json, get_local_url, \
+    iter_collection
+from ansible_common_f5.utils import F5_REFERENCE_KEYS, camel_to_snake, convert, diff_items, has_changed, \
+    items_have_changed, missing_required_params, snake_to_camel
 
 # Common choices
 F5_ACTIVATION_CHOICES = ['enabled', 'disabled']
@@ -40,6 +52,13 @@ F5_POLAR_CHOICES = ['yes', 'no']
 F5_SEVERITY_CHOICES = ['alert', 'crit', 'debug', 'emerg', 'err', 'info', 'notice', 'warning']
 F5_STATE_CHOICES = ['present', 'absent']
 F5_SWITCH_CHOICES = ['on', 'off']
+F5_WRITE_CONFIRMATION_CHOICES = ['response', 'verify', 'none']
+
+# Lifetime of the authentication tokens when the F5 system does not say
+F5_TOKEN_DEFAULT_TIMEOUT = 1200
+
+# Oldest supported version of the f5-sdk
+F5SDK_MIN_VERSION = (3, 0, 15)
 
 # Common arguments
 F5_PROVIDER_ARGS = dict(
@@ -47,7 +66,17 @@ F5_PROVIDER_ARGS = dict(
     f5_username=dict(type='str', required=True),
     f5_password=dict(type='str', required=True, no_log=True),
     f5_port=dict(type='int', default=443),
-    f5_verify=dict(type='bool', default=False)
+    f5_verify=dict(type='bool', default=False),
+    f5_retries=dict(type='int', default=3),
+    f5_timeout=dict(type='int', default=10),
+    f5_request_timeout=dict(type='float'),
+    f5_token_cache=dict(type='bool', default=False),
+    f5_capability_cache=dict(type='bool', default=False),
+    f5_generation_cache=dict(type='bool', default=False),
+    f5_rate_limit=dict(type='float'),
+    f5_rate_burst=dict(type='int'),
+    f5_max_concurrency=dict(type='int'),
+    f5_cache_dir=dict(type='path')
 )
 F5_NAMED_OBJ_ARGS = dict(
     name=dict(type='str', required=True),
@@ -57,31 +86,448 @@ F5_NAMED_OBJ_ARGS = dict(
 )
 
 
+def has_f5sdk():
+    """Tell whether a supported version of the f5-sdk is installed.
+
+    Only the top package of the f5-sdk is imported (for its version): its resource tree takes a while to import, so
+    the clients import it only when they connect.
+    """
+    try:
+        import f5
+    except ImportError:
+        return False
+    version = tuple(int(x) for x in re.findall(r'\d+', getattr(f5, '__version__', ''))[:3])
+    return version >= F5SDK_MIN_VERSION
+
+
 class AnsibleF5Error(Exception):
     pass
 
 
+# Messages of the socket errors raised when the host name cannot be resolved
+NAME_RESOLUTION_ERRORS = ('Name or service not known', 'nodename nor servname', 'getaddrinfo failed',
+                          'No address associated with hostname')
+
+
+class F5RetryPolicy(object):
+    """Retry policy for the calls made to an F5 system
+
+    Failed calls are retried with a capped exponential backoff and full jitter, so that many forks do not hammer a
+    recovering F5 system in lockstep. Permanent errors (eg bad credentials or unknown host) are raised immediately.
+    """
+
+    # The request was rejected before being processed, it is always safe to send it again
+    RETRYABLE_STATUS_CODES = frozenset([429, 503])
+    # The request may have been processed, only idempotent requests can be sent again
+    IDEMPOTENT_RETRYABLE_STATUS_CODES = frozenset([502, 504])
+    # Longest delay accepted from a Retry-After header
+    MAX_RETRY_AFTER = 120
+
+    def __init__(self, retries=3, backoff=1, max_backoff=10):
+        self.retries = max(retries, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_provider(cls, provider):
+        retries = provider.get('f5_retries')
+        max_backoff = provider.get('f5_timeout')
+        return cls(retries=3 if retries is None else retries, max_backoff=10 if max_backoff is None else max_backoff)
+
+    def execute(self, fn, idempotent=True):
+        """Call fn until it succeeds, the error is not retryable, or the retries are exhausted."""
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as exc:
+                attempt += 1
+                if attempt >= self.retries or not self.is_retryable(exc, idempotent):
+                    raise
+                incr('retries')
+                time.sleep(self.get_delay(attempt, exc))
+
+    def is_retryable(self, exc, idempotent=True):
+        """Tell whether the call that raised exc may succeed if it is sent again."""
+        if isinstance(exc, HTTPError):
+            if exc.response is None:
+                return False
+            status_code = exc.response.status_code
+            if status_code in self.RETRYABLE_STATUS_CODES:
+                return True
+            return idempotent and status_code in self.IDEMPOTENT_RETRYABLE_STATUS_CODES
+        if isinstance(exc, ConnectTimeout):
+            # Nothing was sent
+            return True
+        if isinstance(exc, RequestsConnectionError):
+            if self._is_name_resolution_error(exc):
+                return False
+            # Connection refused or reset: the request may have been sent (unless no connection was established)
+            return idempotent or 'NewConnectionError' in str(exc)
+        if isinstance(exc, Timeout):
+            return idempotent
+        return False
+
+    def get_delay(self, attempt, exc=None):
+        """Get the number of seconds to wait before the given retry attempt."""
+        retry_after = self._get_retry_after(exc)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _get_retry_after(self, exc):
+        response = getattr(exc, 'response', None)
+        if response is None or response.headers.get('Retry-After') is None:
+            return None
+
+        value = response.headers['Retry-After'].strip()
+        if value.isdigit():
+            delay = int(value)
+        else:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            delay = mktime_tz(date) - time.time()
+
+        return min(max(delay, 0), self.MAX_RETRY_AFTER)
+
+    @staticmethod
+    def _is_name_resolution_error(exc):
+        # Walk the chain of wrapped exceptions (requests -> urllib3 -> socket)
+        pending, seen = [exc], set()
+        while pending:
+            exc = pending.pop()
+            if exc is None or id(exc) in seen:
+                continue
+            seen.add(id(exc))
+            if isinstance(exc, socket.gaierror):
+                return True
+            if any(msg in str(exc) for msg in NAME_RESOLUTION_ERRORS):
+                return True
+            wrapped = list(getattr(exc, 'args', ()))
+            wrapped += [getattr(exc, 'reason', None), getattr(exc, '__cause__', None),
+                        getattr(exc, '__context__', None)]
+            pending.extend(e for e in wrapped if isinstance(e, BaseException))
+        return False
+
+
 class F5BaseClient(with_metaclass(ABCMeta)):
     """Base class for all F5 clients
 
     It provides an interface to a single F5 system.
+
+    Management roots are pooled per process and keyed by provider, so that all the clients connecting to the same F5
+    system with the same credentials share a single authenticated session.
     """
 
-    @abstractproperty
+    # Login provider used to request an authentication token (None for basic authentication)
+    _token_type = None
+
+    # Process-wide pool of management roots
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    # Capabilities of the F5 systems, and how long (in seconds) they are kept
+    _capabilities = {}
+    _capabilities_lock = threading.Lock()
+    _capability_ttl = 3600
+
+    def __init__(self, **kwargs):
+        # Fill the missing provider args with their default value
+        self.provider = dict((k, spec.get('default')) for k, spec in iteritems(F5_PROVIDER_ARGS))
+        self.provider.update(kwargs.get('provider', None) or {})
+
+    @property
     def mgmt_root(self):
         """Get the Management Root.
 
-        Any class inheriting from F5BaseClient should implement and override this method.
+        Return the pooled Management Root of this provider, connecting to the F5 system only if there is none yet
+        (or if the token it was given is about to expire).
         """
-        pass
+        entry = self._get_session_entry()
+
+        with entry['lock']:
+            password_hash = self._hash_password()
+            expired = entry['expiration'] is not None and entry['expiration'] <= time.time()
+            if entry['mgmt_root'] is None or entry['password_hash'] != password_hash or expired:
+                entry['mgmt_root'], entry['expiration'] = self._connect()
+                entry['password_hash'] = password_hash
+                # Count the requests and bytes of the session (see metrics)
+                session = entry['mgmt_root']._meta_data['icr_session'].session
+                session.hooks['response'].append(record_response)
+                # Do not wait forever for a hung F5 system
+                if self.provider.get('f5_request_timeout'):
+                    session.mount('https://', F5TimeoutAdapter(session.get_adapter('https://'),
+                                                               self.provider['f5_request_timeout']))
+                # Send the requests within the rate limit of the F5 system
+                limiter = self._rate_limiter
+                if limiter is not None:
+                    session.mount('https://', F5RateLimitedAdapter(session.get_adapter('https://'), limiter))
+            return entry['mgmt_root']
+
+    def _new_mgmt_root(self, **kwargs):
+        """Create a new Management Root, passing the given keyword arguments to the f5-sdk.
+
+        Any class inheriting from F5BaseClient and relying on the pooled mgmt_root should override this method. It is
+        not abstract, so that the classes overriding mgmt_root itself (as they had to before the pooling) still work.
+        """
+        raise AnsibleF5Error('{0} does not implement _new_mgmt_root.'.format(self.__class__.__name__))
 
-    @abstractproperty
-    def _system_version(self):
-        """Get the version of the F5 system.
+    def _connect(self):
+        """Connect to the F5 system.
 
-        Any class inheriting from F5BaseClient should implement and override this method.
+        Return a new Management Root, and the time after which it must not be used anymore (or None).
         """
-        pass
+        # The certificate of the F5 system is not checked on purpose
+        if not self.provider['f5_verify']:
+            urllib3.disable_warnings(InsecureRequestWarning)
+
+        token_cache = self._token_cache
+        if token_cache is None:
+            return self._login(), None
+
+        # Reuse the token obtained by another process
+        key = self._token_cache_key
+        cached = token_cache.get_token(key)
+        if cached is not None:
+            try:
+                return self._new_limited_mgmt_root(token_to_use=cached['token']), \
+                       cached['expiration'] - token_cache.REFRESH_MARGIN
+            except HTTPError as exc:
+                if exc.response is not None and exc.response.status_code == 401:
+                    token_cache.delete(key)
+            except Exception:
+                pass
+
+        mgmt_root = self._login()
+
+        # Share the new token with the other processes
+        token, expiration = self._get_session_token(mgmt_root)
+        if token is not None:
+            token_cache.set_token(key, token, expiration)
+
+        return mgmt_root, None
+
+    def _login(self):
+        """Log in to the F5 system and return a new Management Root."""
+        try:
+            with timed('login'):
+                return self._retry_policy.execute(partial(self._new_limited_mgmt_root, token=self._token_type))
+        except Exception as exc:
+            err_msg = 'Unable to connect to host {0} on port {1}.'.format(self.provider['f5_hostname'],
+                                                                          self.provider['f5_port'])
+            err_msg += ' The error message was "{0}".'.format(str(exc))
+            raise AnsibleF5Error(err_msg)
+
+    def _new_limited_mgmt_root(self, **kwargs):
+        """Create a new Management Root (see _new_mgmt_root), within the rate limit of the F5 system."""
+        limiter = self._rate_limiter
+        if limiter is None:
+            return self._new_mgmt_root(**kwargs)
+        with limiter.request():
+            return self._new_mgmt_root(**kwargs)
+
+    @property
+    def _retry_policy(self):
+        return F5RetryPolicy.from_provider(self.provider)
+
+    @property
+    def _rate_limiter(self):
+        if not self.provider.get('f5_rate_limit') and not self.provider.get('f5_max_concurrency'):
+            return None
+        return F5RateLimiter(get_cache_dir(self.provider), self.provider['f5_hostname'], self.provider['f5_port'],
+                             rate=self.provider.get('f5_rate_limit'), burst=self.provider.get('f5_rate_burst'),
+                             max_concurrency=self.provider.get('f5_max_concurrency'))
+
+    @property
+    def _token_cache(self):
+        if self._token_type is None or not self.provider.get('f5_token_cache'):
+            return None
+        return F5TokenCache(get_cache_dir(self.provider))
+
+    @property
+    def _token_cache_key(self):
+        # The tokens are only shared with the processes given the same password: a wrong (or rotated) password must
+        # fail as it does without the cache. The password is salted with the rest of the key, never stored in clear.
+        key = '{0}:{1}:{2}:{3}'.format(self.provider['f5_hostname'], self.provider['f5_port'],
+                                       self.provider['f5_username'], self._token_type)
+        digest = hashlib.sha256('{0}:{1}'.format(key, self.provider['f5_password'] or '').encode('utf-8')).hexdigest()
+        return '{0}:{1}'.format(key, digest)
+
+    @staticmethod
+    def _get_session_token(mgmt_root):
+        """Get the authentication token of a Management Root, and its expiration time."""
+        auth = mgmt_root._meta_data['icr_session'].session.auth
+        token = getattr(auth, 'token', None)
+        if token is None:
+            return None, None
+        expiration = getattr(auth, 'expiration', None) or time.time() + F5_TOKEN_DEFAULT_TIMEOUT
+        return token, expiration
+
+    @property
+    def _session_key(self):
+        return (self.__class__.__name__,
+                self.provider['f5_hostname'],
+                self.provider['f5_port'],
+                self.provider['f5_username'],
+                self.provider['f5_verify'],
+                self.provider.get('f5_request_timeout'),
+                self._token_type)
+
+    def _hash_password(self):
+        password = self.provider['f5_password'] or ''
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+    def _get_session_entry(self):
+        with F5BaseClient._sessions_lock:
+            entry = F5BaseClient._sessions.get(self._session_key)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'mgmt_root': None, 'password_hash': None, 'expiration': None}
+                F5BaseClient._sessions[self._session_key] = entry
+            return entry
+
+    def discard_session(self):
+        """Remove the Management Root of this provider from the pool."""
+        with F5BaseClient._sessions_lock:
+            F5BaseClient._sessions.pop(self._session_key, None)
+
+    @classmethod
+    def clear_sessions(cls):
+        """Remove all the Management Roots from the pool."""
+        with F5BaseClient._sessions_lock:
+            F5BaseClient._sessions.clear()
+
+    @property
+    def capabilities(self):
+        """Get the capabilities of the F5 system: its version and product, its provisioned modules, and the endpoints
+        probed so far (see supports_endpoint).
+
+        They are discovered once per device and kept until they expire, in memory and (if f5_capability_cache) in a
+        local cache shared by the processes.
+        """
+        key = self._capabilities_key
+        with F5BaseClient._capabilities_lock:
+            entry = F5BaseClient._capabilities.get(key)
+        if entry is not None and entry['expiration'] > time.time():
+            return entry['capabilities']
+
+        cache = self._capability_cache
+        entry = cache.get_capabilities(key) if cache is not None else None
+        if entry is None:
+            entry = {'capabilities': self._discover_capabilities(), 'expiration': time.time() + self._capability_ttl}
+            if cache is not None:
+                cache.set_capabilities(key, entry['capabilities'], entry['expiration'])
+
+        with F5BaseClient._capabilities_lock:
+            F5BaseClient._capabilities[key] = entry
+        return entry['capabilities']
+
+    def supports_endpoint(self, path):
+        """Tell whether the F5 system supports an endpoint (eg '/mgmt/tm/ltm/profile/http2'), probing it only once."""
+        capabilities = self.capabilities
+        if path in capabilities['endpoints']:
+            return capabilities['endpoints'][path]
+
+        try:
+            try:
+                # A single item is enough, the collection may be huge
+                get_json(self.mgmt_root, path, params={'$top': 1})
+            except HTTPError as exc:
+                # Not a collection, or no paging support: probe it as it is
+                if exc.response is None or exc.response.status_code != 400:
+                    raise
+                get_json(self.mgmt_root, path)
+            supported = True
+        except HTTPError as exc:
+            if exc.response is None or exc.response.status_code not in (400, 404, 501):
+                raise
+            supported = False
+
+        with F5BaseClient._capabilities_lock:
+            capabilities['endpoints'][path] = supported
+        cache = self._capability_cache
+        if cache is not None:
+            with cache.transaction() as data:
+                if self._capabilities_key in data:
+                    data[self._capabilities_key]['capabilities']['endpoints'][path] = supported
+        return supported
+
+    def _discover_capabilities(self):
+        """Discover the capabilities of the F5 system.
+
+        Classes inheriting from F5BaseClient may override this method if their F5 system tells its version otherwise.
+        """
+        info = get_json(self.mgmt_root, '/mgmt/shared/identified-devices/config/device-info')
+        return dict(version=info.get('version'), product=info.get('product'), modules=self._get_provisioned_modules(),
+                    endpoints={})
+
+    def _get_provisioned_modules(self):
+        try:
+            items = iter_collection(self.mgmt_root, get_base_url(self.mgmt_root) + '/mgmt/tm/sys/provision',
+                                    select=['name', 'level'])
+            return sorted(item['name'] for item in items if item.get('level', 'none') != 'none')
+        except HTTPError as exc:
+            # Not a TMOS system
+            if exc.response is None or exc.response.status_code != 404:
+                raise
+            return []
+
+    @property
+    def _capability_cache(self):
+        if not self.provider.get('f5_capability_cache'):
+            return None
+        return F5CapabilityCache(get_cache_dir(self.provider))
+
+    @property
+    def _capabilities_key(self):
+        return '{0}:{1}:{2}'.format(self.__class__.__name__, self.provider['f5_hostname'], self.provider['f5_port'])
+
+    @property
+    def _system_version(self):
+        """Get the version of the F5 system."""
+        return self.capabilities['version']
+
+
+class F5ParamSchema(object):
+    """How the params of an F5 object class are prepared, computed once per class
+
+    It holds the camel case name of the params, the translations of the conflictual params and the params backed by
+    a property of the class. The params vary between the instances of a class, so the entries are added on first use
+    and then shared by all the instances.
+    """
+
+    def __init__(self, cls):
+        self._cls = cls
+        self._camel_keys = {}
+        self._translations = {}
+        self._property_names = {}
+
+    def to_camel(self, params):
+        """Change Snake to Camel naming convention of the keys of the params."""
+        camel_params = {}
+        for k, v in iteritems(params):
+            ck = self._camel_keys.get(k)
+            if ck is None:
+                ck = self._camel_keys[k] = snake_to_camel(k)
+            camel_params[ck] = v
+        return camel_params
+
+    def get_translations(self, tr):
+        """Get the (camel case) keys of the translated params, and their new keys."""
+        key = frozenset(iteritems(tr))
+        translations = self._translations.get(key)
+        if translations is None:
+            translations = self._translations[key] = [(snake_to_camel(k), snake_to_camel(v)) for k, v in key]
+        return translations
+
+    def get_property_name(self, key):
+        """Get the name of the property backing a (camel case) param, or None."""
+        try:
+            return self._property_names[key]
+        except KeyError:
+            ks = camel_to_snake(key)
+            name = self._property_names[key] = ks if hasattr(self._cls, ks) else None
+            return name
 
 
 class F5BaseObject(with_metaclass(ABCMeta)):
@@ -90,6 +536,35 @@ class F5BaseObject(with_metaclass(ABCMeta)):
     It represents an F5 resource configurable by Ansible.
     """
 
+    # Keys ignored when comparing the current and new values of the params
+    _diff_exclude_keys = F5_REFERENCE_KEYS
+
+    # Params (lists of dicts) held in a subcollection of the resource, eg {'members': 'members'} for a pool, compared
+    # by paging through the subcollection
+    _subcollection_params = {}
+
+    # The items of the subcollection params (keyed by name) are added, modified and removed one by one, unless more
+    # than this ratio of them change: the whole param is sent then (None to always send it)
+    _delta_max_ratio = 0.5
+
+    # Number of items loaded per page when paging through a collection
+    _page_size = DEFAULT_PAGE_SIZE
+
+    # Whether the reads only load the managed params (see _get_read_select)
+    _projected_reads = True
+
+    # Fields always loaded with the managed params
+    _identity_fields = ('name', 'partition', 'subPath', 'fullPath', 'selfLink', 'kind', 'generation')
+
+    # Classes of the objects whose endpoint rejected a projected read
+    _select_rejected = set()
+
+    # Params referring to other objects by name or full path (eg the pool of a virtual server), from which
+    # F5DependencyScheduler orders the flushes
+    _reference_params = frozenset(['defaultsFrom', 'destination', 'fallbackPersistence', 'lastHopPool', 'members',
+                                   'monitor', 'node', 'persist', 'policies', 'pool', 'profiles', 'rules',
+                                   'sourceAddressTranslation', 'vlans'])
+
     def __init__(self, **kwargs):
         """Prepare the parameters needed by this module."""
         super(F5BaseObject, self).__init__()
@@ -100,17 +575,28 @@ class F5BaseObject(with_metaclass(ABCMeta)):
         self._required_update_params = set()
 
         # Store and remove BIG-IP and Ansible params
-        self._provider = {'f5_hostname': kwargs.pop('f5_hostname', None),
-                          'f5_username': kwargs.pop('f5_username', None),
-                          'f5_password': kwargs.pop('f5_password', None),
-                          'f5_port': kwargs.pop('f5_port', None),
-                          'f5_verify': kwargs.pop('f5_verify', None)}
+        self._provider = dict((k, kwargs.pop(k, spec.get('default'))) for k, spec in iteritems(F5_PROVIDER_ARGS))
         self._state = kwargs.pop('state', None)
         self._check_mode = kwargs.pop('check_mode', None)
         self._tr = kwargs.pop('tr', None)
+        self._prefetch = kwargs.pop('prefetch', None)
+        self._metrics = kwargs.pop('metrics', False)
+
+        # How the writes are confirmed: by their response (the default), by reading the object back, or not at all
+        self._write_confirmation = kwargs.pop('write_confirmation', None) or 'response'
+        if self._write_confirmation not in F5_WRITE_CONFIRMATION_CHOICES:
+            raise AnsibleF5Error("Invalid write confirmation: %s" % self._write_confirmation)
+
+        # Plan mode: the changes are computed against a snapshot of the configuration (see F5ConfigSnapshot), without
+        # reading or writing the F5 system
+        self._snapshot = kwargs.pop('snapshot', None)
+        if self._snapshot is not None:
+            self._check_mode = True
+            self._prefetch = self._snapshot
 
         # Change Snake to Camel naming convention of the params that are sent to the module
-        self._params = change_dict_naming_convention(kwargs, snake_to_camel)
+        schema = self._get_schema()
+        self._params = schema.to_camel(kwargs)
 
         # Set CRUD methods
         self._methods = {}
@@ -118,24 +604,89 @@ class F5BaseObject(with_metaclass(ABCMeta)):
 
         # Translate conflictual params (eg 'state')
         if self._tr is not None:
-            for k, v in iteritems(self._tr):
-                kc = snake_to_camel(k)
+            for kc, vc in schema.get_translations(self._tr):
                 if kc in self._params:
-                    self._params[snake_to_camel(v)] = self._params[kc]
-                    del self._params[kc]
+                    self._params[vc] = self._params.pop(kc)
 
         # Call property objects
-        for k in self._params:
-            try:
-                ks = camel_to_snake(k)
-                if getattr(self, ks) is not None:
-                    self._params[k] = getattr(self, ks)
-            except AttributeError:
-                pass
+        for k in list(self._params):
+            ks = schema.get_property_name(k)
+            if ks is not None:
+                try:
+                    value = getattr(self, ks)
+                except AttributeError:
+                    continue
+                if value is not None:
+                    self._params[k] = value
 
         # The object
         self._obj = None
 
+        # When not None, the writes are queued in this list instead of being sent (eg to batch them in a transaction)
+        self._deferred_writes = None
+
+        # Changes of the subcollection params applied item by item (see _subcollection_has_changed)
+        self._subcollection_deltas = {}
+
+        # Changes found in check mode (added to the flush result in plan mode)
+        self._plan = None
+
+    @classmethod
+    def _get_schema(cls):
+        # Each class has its own schema (not the one of its parent class)
+        schema = cls.__dict__.get('_param_schema')
+        if schema is None:
+            schema = F5ParamSchema(cls)
+            cls._param_schema = schema
+        return schema
+
+    @property
+    def _retry_policy(self):
+        return F5RetryPolicy.from_provider(self._provider)
+
+    def _call(self, fn, *args, **kwargs):
+        """Call an idempotent method of the F5 system, retrying the transient failures."""
+        return self._retry_policy.execute(partial(fn, *args, **kwargs))
+
+    def _call_once(self, fn, *args, **kwargs):
+        """Call a non-idempotent method of the F5 system, retrying only the requests that were not processed."""
+        return self._retry_policy.execute(partial(fn, *args, **kwargs), idempotent=False)
+
+    def _defer(self, fn, *args, **kwargs):
+        """Queue a write if the writes of this object are deferred, and tell whether it was queued."""
+        if self._deferred_writes is None:
+            return False
+        self._deferred_writes.append(partial(fn, *args, **kwargs))
+        return True
+
+    def _write(self, fn, *args, **kwargs):
+        """Send (or queue) a non-idempotent write of the F5 system."""
+        if not self._defer(fn, *args, **kwargs):
+            self._call_once(fn, *args, **kwargs)
+
+    @contextmanager
+    def _instrument(self, result):
+        """Collect the metrics of a flush, add them to its result if requested, and log them."""
+        if not self._metrics and not LOG.isEnabledFor(logging.DEBUG):
+            yield
+            return
+
+        with collect_metrics() as metrics:
+            with timed('flush'):
+                yield
+
+        data = metrics.as_dict()
+        if self._metrics:
+            result['metrics'] = data
+
+        record = dict(data, object=self.__class__.__name__, host=self._provider['f5_hostname'],
+                      changed=result.get('changed'))
+        LOG.debug('flush %s', json.dumps(record, sort_keys=True), extra={'f5_metrics': record})
+
+    def _after_write(self):
+        """Called when a write (create, modify, update or delete) is sent or queued for this object."""
+        pass
+
     @abstractmethod
     def _set_crud_methods(self):
         """Set the CRUD methods for this object.
@@ -170,45 +721,225 @@ class F5BaseObject(with_metaclass(ABCMeta)):
         """
         pass
 
-    def _update(self):
-        """Update an object on the F5 system."""
-        # Load the object
-        self._obj = self._read()
+    @property
+    def _capabilities(self):
+        """Get the capabilities of the F5 system (see F5BaseClient.capabilities)."""
+        return self._client.capabilities
 
-        # Check params
-        self._check_update_params()
+    def _supports_endpoint(self, path):
+        return self._client.supports_endpoint(path)
 
-        changed = False
-        cparams = {}  # The params that have changed
+    def _get_read_select(self):
+        """Get the fields to load when reading the object, or None to load all of them.
+
+        Only the managed params are compared, so the other fields are not loaded, unless the object is written with
+        update (PUT sends back the whole object, the fields left out would be reset).
+        """
+        if not self._projected_reads or 'modify' not in self._methods or type(self) in F5BaseObject._select_rejected:
+            return None
+        fields = set(k for k, v in iteritems(self._params) if v is not None and k not in self._subcollection_params)
+        return sorted(fields.union(self._identity_fields))
+
+    def _call_read(self, fn, **kwargs):
+        """Read the object with fn, loading only the fields given by _get_read_select."""
+        select = self._get_read_select()
+        with timed('read'):
+            if select is None:
+                return self._call(fn, **kwargs)
+
+            try:
+                return self._call(fn, requests_params={'params': {'$select': ','.join(select)}}, **kwargs)
+            except HTTPError as exc:
+                # The endpoint does not support $select, read the whole object from now on
+                if exc.response is None or exc.response.status_code != 400:
+                    raise
+                F5BaseObject._select_rejected.add(type(self))
+                return self._call(fn, **kwargs)
+
+    def _has_changed(self, key, cur_val, new_val):
+        """Tell whether the current value of a param differs from its new value.
+
+        Classes inheriting from F5BaseObject may override this method to compare some params differently.
+        """
+        return has_changed(cur_val, new_val, self._diff_exclude_keys)
+
+    def _get_changed_params(self):
+        """Get the params whose value differs from the loaded object."""
+        with timed('diff'):
+            return self._compare_params()
+
+    def _compare_params(self):
+        cparams = {}
+        self._subcollection_deltas = {}
 
-        # Determine if some params have changed
         for key, new_val in iteritems(self._params):
             if new_val is not None:
-                if hasattr(self._obj, key):
+                if key in self._subcollection_params:
+                    if self._subcollection_has_changed(key, new_val):
+                        cparams[key] = new_val
+                elif hasattr(self._obj, key):
                     cur_val = convert(getattr(self._obj, key))
-                    ddiff = DeepDiff(cur_val, new_val, ignore_order=True,
-                                     exclude_paths={"root['nameReference']", "root['poolReference']"})
-                    if ddiff:
+                    if self._has_changed(key, cur_val, new_val):
                         cparams[key] = new_val
                 else:
                     if new_val:
                         cparams[key] = new_val
 
+        return cparams
+
+    def _get_subcollection_uri(self, name):
+        # The URI of a resource loaded from a snapshot is its link, which refers to the F5 system as 'localhost'
+        return '{0}/{1}'.format(get_local_url(self._api, self._obj._meta_data['uri']).rstrip('/'), name)
+
+    def _iter_subcollection(self, name, select=None):
+        """Iterate over the items of a subcollection of the loaded object, one page at a time.
+
+        The items already loaded with the object (eg with expandSubcollections) are not loaded again.
+        """
+        reference = getattr(self._obj, name + 'Reference', None)
+        if isinstance(reference, dict) and 'items' in reference:
+            return iter(reference['items'])
+        if self._snapshot is not None and self._snapshot.has_subcollections(self._obj._meta_data['uri']):
+            # The F5 system leaves the items of an empty subcollection out
+            return iter([])
+        return iter_collection(self._api, self._get_subcollection_uri(name), select=select, page_size=self._page_size)
+
+    def _subcollection_has_changed(self, key, new_val):
+        """Tell whether a subcollection differs from the new value of its param, without loading it at once.
+
+        When few of its items change, the changes are kept to be applied item by item by _update.
+        """
+        fields = set(k for item in new_val for k in item) - self._diff_exclude_keys
+        name = self._subcollection_params[key]
+
+        if self._delta_max_ratio is None or not new_val or not all('name' in item for item in new_val):
+            cur_items = self._iter_subcollection(name, select=sorted(fields))
+            return items_have_changed(cur_items, new_val, self._diff_exclude_keys)
+
+        cur_items = self._iter_subcollection(name, select=sorted(fields.union(['name', 'selfLink'])))
+        delta = diff_items(cur_items, new_val, max_changes=int(self._delta_max_ratio * len(new_val)),
+                           exclude_keys=self._diff_exclude_keys)
+        if delta is None:
+            # Too many changes, the whole param is sent
+            return True
+
+        if not any(delta.values()):
+            return False
+        self._subcollection_deltas[key] = delta
+        return True
+
+    def _apply_subcollection_delta(self, key, delta):
+        """Remove, modify and add the changed items of a subcollection."""
+        uri = self._get_subcollection_uri(self._subcollection_params[key])
+        session = self._api._meta_data['icr_session']
+
+        def get_item_uri(item):
+            if 'selfLink' in item:
+                return get_local_url(self._api, item['selfLink'])
+            return '{0}/{1}'.format(uri, item['name'])
+
+        for item in delta['removed']:
+            self._write(session.delete, get_item_uri(item))
+        for item, fields in delta['modified']:
+            self._write(session.patch, get_item_uri(item), json=fields)
+        for item in delta['added']:
+            self._write(session.post, uri, json=item)
+
+    def _update(self):
+        """Update an object on the F5 system."""
+        # Load the object (unless already loaded by flush)
+        if self._obj is None:
+            self._obj = self._read()
+
+        # Check params
+        self._check_update_params()
+
+        changed = False
+        cparams = self._get_changed_params()
+
         # If changed params, update the object
         if cparams:
             changed = True
 
             if self._check_mode:
+                self._plan = dict(action='update', params=cparams)
                 return changed
 
-            if 'modify' in self._methods:
-                self._obj.modify(**cparams)
-            else:
-                self._obj.update(**cparams)
-            self._obj.refresh()
+            self._after_write()
+
+            with timed('write'):
+                # The subcollection params changing little are applied item by item
+                for key, delta in iteritems(self._subcollection_deltas):
+                    del cparams[key]
+                    self._apply_subcollection_delta(key, delta)
+
+                if cparams:
+                    write = self._obj.modify if 'modify' in self._methods else self._obj.update
+                    if not self._defer(write, **cparams):
+                        self._call(write, **cparams)
+                    # The f5-sdk refreshes the object with the response, no need to load it again
+
+            if self._write_confirmation == 'verify' and self._deferred_writes is None:
+                self._verify_update()
 
         return changed
 
+    def _verify_update(self):
+        """Read the object back and check that its changes were applied."""
+        self._obj = self._read()
+        cparams = self._get_changed_params()
+        if cparams:
+            raise AnsibleF5Error("Failed to update the params: %s" % sorted(cparams))
+
+    @property
+    def _generation_cache(self):
+        # The subcollections change without changing the generation of their resource
+        if not self._provider.get('f5_generation_cache') or any(k in self._params for k in self._subcollection_params):
+            return None
+        return F5GenerationCache(get_cache_dir(self._provider), self._provider['f5_hostname'],
+                                 self._provider['f5_port'])
+
+    @property
+    def _generation_key(self):
+        return self.__class__.__name__
+
+    def _get_params_fingerprint(self):
+        data = json.dumps([self._state, self._params], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _is_unchanged(self, **res_id):
+        """Tell whether the object was flushed with the same params and did not change since (see f5_generation_cache).
+
+        Only the generation of the resource is loaded to tell.
+        """
+        cache = self._generation_cache
+        if cache is None:
+            return False
+
+        entry = cache.get(self._generation_key)
+        if entry is None or entry['fingerprint'] != self._get_params_fingerprint():
+            return False
+
+        with timed('generation'):
+            try:
+                obj = self._call(self._methods['read'],
+                                 requests_params={'params': {'$select': 'generation,kind,selfLink'}}, **res_id)
+            except HTTPError:
+                return False
+        return getattr(obj, 'generation', None) == entry['generation']
+
+    def _save_generation(self):
+        """Remember the params and the generation of the object after its flush (see f5_generation_cache)."""
+        cache = self._generation_cache
+        if cache is None or self._check_mode:
+            return
+
+        generation = getattr(self._obj, 'generation', None)
+        if generation is None or self._deferred_writes is not None:
+            cache.delete(self._generation_key)
+        else:
+            cache.set(self._generation_key, self._get_params_fingerprint(), generation)
+
     @abstractmethod
     def flush(self):
         """Send the buffered object to the F5 system.
@@ -223,17 +954,50 @@ class F5NamedBaseObject(F5BaseObject):
     def _set_crud_methods(self):
         raise NotImplemented
 
+    @property
+    def _collection(self):
+        """Get the f5-sdk collection of this object (derived from its read method unless set in the CRUD methods)."""
+        if 'collection' in self._methods:
+            return self._methods['collection']
+        resource = getattr(self._methods.get('read'), '__self__', None)
+        return getattr(resource, '_meta_data', {}).get('container')
+
+    def _iter_collection(self, select=None):
+        """Iterate over the resources (dicts) of the collection of this object, one page at a time."""
+        return iter_collection(self._api, self._collection._meta_data['uri'], select=select, page_size=self._page_size)
+
+    def _get_prefetched(self):
+        """Look up the object in the prefetched collections.
+
+        Return whether the object is known, and the object (None if it does not exist).
+        """
+        if self._prefetch is None or self._collection is None:
+            return False, None
+        return self._prefetch.lookup(self._collection, self._get_resource_id_from_params())
+
+    def _after_write(self):
+        if self._prefetch is not None and self._collection is not None:
+            self._prefetch.discard(self._collection, self._get_resource_id_from_params())
+
     def _exists(self):
         """Check for the existence of the named object on the F5 system."""
+        known, obj = self._get_prefetched()
+        if known:
+            return obj is not None
+
         try:
-            return self._methods['exists'](**self._get_resource_id_from_params())
+            with timed('exists'):
+                return self._call(self._methods['exists'], **self._get_resource_id_from_params())
         except HTTPError:
             return False
 
     def _read(self):
         """Load an already configured object from the F5 system."""
         self._check_load_params()
-        obj = self._methods['read'](**self._get_resource_id_from_params())
+
+        known, obj = self._get_prefetched()
+        if obj is None:
+            obj = self._call_read(self._methods['read'], **self._get_resource_id_from_params())
 
         for attr, value in vars(obj).items():
             if isinstance(value, list):
@@ -244,6 +1008,22 @@ class F5NamedBaseObject(F5BaseObject):
 
         return obj
 
+    def _load(self):
+        """Load the named object from the F5 system, or return None if it does not exist.
+
+        A single load answers both the existence and the current state of the object.
+        """
+        known, obj = self._get_prefetched()
+        if known and obj is None:
+            return None
+
+        try:
+            return self._read()
+        except HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 404:
+                return None
+            raise
+
     def _create(self):
         """Create an object on the F5 system."""
         # Remove empty params
@@ -253,46 +1033,63 @@ class F5NamedBaseObject(F5BaseObject):
         self._check_create_params()
 
         if self._check_mode:
+            self._plan = dict(action='create', params=params)
+            return True
+
+        self._after_write()
+        if self._defer(self._methods['create'], **params):
             return True
 
         # Create the object
-        self._methods['create'](**params)
+        with timed('write'):
+            self._obj = self._call_once(self._methods['create'], **params)
 
-        # Make sure it is created
-        if self._exists():
-            return True
-        else:
-            raise AnsibleF5Error("Failed to create the object.")
+        # The created object (the response) confirms the creation, unless the create method does not return it
+        if self._write_confirmation == 'verify' or (self._write_confirmation == 'response' and self._obj is None):
+            if not self._exists():
+                raise AnsibleF5Error("Failed to create the object.")
+
+        return True
 
     def _delete(self):
         """Delete an object on the F5 system."""
-        # Load the object
-        self._obj = self._read()
+        # Load the object (unless already loaded by flush)
+        if self._obj is None:
+            self._obj = self._read()
 
         if self._check_mode:
+            self._plan = dict(action='delete')
             return True
 
-        # Delete the object
-        self._obj.delete()
+        self._after_write()
+        if self._defer(self._obj.delete):
+            return True
+
+        # Delete the object (an error response is raised by the f5-sdk)
+        with timed('write'):
+            self._call_once(self._obj.delete)
 
-        # Make sure it is gone
-        if self._exists():
+        # The success response confirms the deletion
+        if self._write_confirmation == 'verify' and self._exists():
             raise AnsibleF5Error("Failed to delete the object.")
 
         return True
 
     def _present(self):
-        if self._exists():
-            has_changed = self._update()
-        else:
+        self._obj = self._load()
+
+        if self._obj is None:
             has_changed = self._create()
+        else:
+            has_changed = self._update()
 
         return has_changed
 
     def _absent(self):
         has_changed = False
 
-        if self._exists():
+        self._obj = self._load()
+        if self._obj is not None:
             has_changed = self._delete()
 
         return has_changed
@@ -301,13 +1098,24 @@ class F5NamedBaseObject(F5BaseObject):
         """Send the buffered object to the F5 system, depending upon the state of the object."""
         result = dict(changed=False)
 
-        if self._state == "present":
-            result['changed'] = self._present()
-        elif self._state == "absent":
-            result['changed'] = self._absent()
+        with self._instrument(result):
+            if self._state == "present":
+                if not self._is_unchanged(**self._get_resource_id_from_params()):
+                    result['changed'] = self._present()
+                    self._save_generation()
+            elif self._state == "absent":
+                result['changed'] = self._absent()
 
+        if self._snapshot is not None:
+            result['plan'] = self._plan
         return result
 
+    @property
+    def _generation_key(self):
+        res_id = self._get_resource_id_from_params()
+        parts = [res_id.get('partition'), res_id.get('subPath'), res_id['name']]
+        return '{0}:/{1}'.format(self.__class__.__name__, '/'.join(p for p in parts if p is not None))
+
     def _strip_partition(self, name):
         partition_prefix = "/{0}/".format(self._params['partition'])
         return str(name.replace(partition_prefix, ''))
@@ -355,10 +1163,24 @@ class F5UnnamedBaseObject(F5BaseObject):
     def _read(self):
         """Load an already configured object from the F5 system."""
         self._check_load_params()
-        return self._methods['read']()
+
+        if self._snapshot is not None:
+            resource = getattr(self._methods['read'], '__self__', None)
+            obj = self._snapshot.get_resource(getattr(resource, '_meta_data', {}).get('uri', ''))
+            if obj is not None:
+                return obj
+
+        return self._call_read(self._methods['read'])
 
     def flush(self):
         """Send the buffered object to the F5 system."""
         result = dict(changed=False)
-        result['changed'] = self._update()
+        with self._instrument(result):
+            if not self._is_unchanged():
+                self._obj = self._read()
+                result['changed'] = self._update()
+                self._save_generation()
+
+        if self._snapshot is not None:
+            result['plan'] = self._plan
         return result
@@ -18,17 +18,10 @@
 """Ansible Common Utility Module for F5 BIG-IP
 """
 
-import time
+from ansible_common_f5.base import AnsibleF5Error, F5BaseClient, F5NamedBaseObject, F5UnnamedBaseObject, has_f5sdk
 
-from ansible_common_f5.base import AnsibleF5Error, F5BaseClient, F5NamedBaseObject, F5UnnamedBaseObject
-
-# Make sure the f5-sdk is installed on the host
-try:
-    from f5.bigip import ManagementRoot as BigIpMgmtRoot
-
-    HAS_F5SDK = True
-except ImportError:
-    HAS_F5SDK = False
+# Make sure the f5-sdk is installed on the host (imported when connecting)
+HAS_F5SDK = has_f5sdk()
 
 
 class F5BigIpClient(F5BaseClient):
@@ -37,55 +30,167 @@ class F5BigIpClient(F5BaseClient):
     It provides an interface to a single F5 BIG-IP system.
     """
 
+    _token_type = 'tmos'
+
     def __init__(self, **kwargs):
         if not HAS_F5SDK:
-            raise AnsibleF5Error("The python f5-sdk module is required. Try 'pip install f5-sdk'.")
-        self.provider = kwargs.get('provider', None)
+            raise AnsibleF5Error("The python f5-sdk module (3.0.15 or later) is required. Try 'pip install -U f5-sdk'.")
+        super(F5BigIpClient, self).__init__(**kwargs)
 
-    @property
-    def mgmt_root(self):
-        err = None
-        retries = self.provider.get('f5_retries', 3)
-        timeout = self.provider.get('f5_timeout', 10)
-
-        for x in range(retries):
-            try:
-                return BigIpMgmtRoot(
-                    self.provider['f5_hostname'],
-                    self.provider['f5_username'],
-                    self.provider['f5_password'],
-                    port=self.provider['f5_port'],
-                    verify=self.provider['f5_verify'],
-                    token='tmos'
-                )
-            except Exception as exc:
-                err = exc
-                time.sleep(timeout)
-
-        err_msg = 'Unable to connect to host {0} on port {1}.'.format(self.provider['f5_hostname'],
-                                                                      self.provider['f5_port'])
-        if err is not None:
-            err_msg += ' The error message was "{0}".'.format(str(err))
-        raise AnsibleF5Error(err_msg)
+    def _new_mgmt_root(self, **kwargs):
+        from f5.bigip import ManagementRoot as BigIpMgmtRoot
 
-    @property
-    def _system_version(self):
-        version = self.mgmt_root.tm.sys.version.load()
-        return version.entries['https://localhost/mgmt/tm/sys/version/0']['nestedStats']['entries'][
-            'Version']['description']
+        return BigIpMgmtRoot(
+            self.provider['f5_hostname'],
+            self.provider['f5_username'],
+            self.provider['f5_password'],
+            port=self.provider['f5_port'],
+            verify=self.provider['f5_verify'],
+            **kwargs
+        )
+
+    def _discover_capabilities(self):
+        # The version is known since the login
+        return dict(version=self.mgmt_root.tmos_version, product='BIG-IP', modules=self._get_provisioned_modules(),
+                    endpoints={})
 
 
 class F5BigIpNamedObject(F5NamedBaseObject):
     """Base class for all F5 BIG-IP named objects"""
 
+    @property
+    def _client(self):
+        return F5BigIpClient(provider=self._provider)
+
     @property
     def _api(self):
-        return F5BigIpClient(provider=self._provider).mgmt_root
+        return self._client.mgmt_root
 
 
 class F5BigIpUnnamedObject(F5UnnamedBaseObject):
     """Base class for all F5 BIG-IP unnamed objects"""
 
+    @property
+    def _client(self):
+        return F5BigIpClient(provider=self._provider)
+
     @property
     def _api(self):
-        return F5BigIpClient(provider=self._provider).mgmt_root
+        return self._client.mgmt_root
+
+
+class F5BigIpTransaction(object):
+    """Batch of F5 BIG-IP objects flushed through TMOS transactions
+
+    The changes of the objects are computed one object at a time (reads cannot be part of a transaction), then their
+    writes are submitted to /mgmt/tm/transaction in chunks of at most chunk_size writes. Each chunk is atomic: either
+    all its changes are applied, or none of them. The writes of an object are never split across chunks, an object
+    with more than chunk_size writes (eg many subcollection items) fails the batch.
+
+    All the objects must use the provider of the batch, so that they share its session with the transaction.
+    """
+
+    def __init__(self, provider, chunk_size=100):
+        if chunk_size < 1:
+            raise AnsibleF5Error("The chunk size must be a positive number.")
+        self._client = F5BigIpClient(provider=provider)
+        self._chunk_size = chunk_size
+        self._objects = []
+
+    def add(self, obj):
+        """Add an object to the batch."""
+        if not isinstance(obj, (F5BigIpNamedObject, F5BigIpUnnamedObject)):
+            raise AnsibleF5Error("Only F5 BIG-IP objects can be flushed in a transaction.")
+        if F5BigIpClient(provider=obj._provider)._session_key != self._client._session_key:
+            raise AnsibleF5Error("The object does not use the provider of the transaction.")
+        self._objects.append(obj)
+
+    def flush(self):
+        """Send the buffered objects to the F5 BIG-IP system.
+
+        Return whether something changed, and the result of each chunk. The first chunk that fails stops the batch;
+        the objects that come after it are reported as skipped.
+        """
+        result = dict(changed=False, failed=False, chunks=[], skipped=0)
+        chunk = self._new_chunk()
+
+        for i, obj in enumerate(self._objects):
+            obj_result, writes = self._plan(obj)
+            if not obj_result.get('failed') and len(writes) > self._chunk_size:
+                obj_result = dict(changed=False, failed=True,
+                                  msg='The object has {0} writes, more than the chunk size ({1}).'.format(
+                                      len(writes), self._chunk_size))
+
+            if obj_result.get('failed'):
+                chunk['results'].append(obj_result)
+                self._fail(chunk, obj_result['msg'])
+            elif chunk['writes'] and len(chunk['writes']) + len(writes) > self._chunk_size:
+                # Submit the chunk before it overflows, the object starts the next one
+                self._submit(chunk)
+                result['chunks'].append(self._chunk_result(chunk))
+                if chunk['failed']:
+                    result['skipped'] = len(self._objects) - i
+                    break
+                chunk = self._new_chunk()
+
+            if chunk['failed']:
+                result['chunks'].append(self._chunk_result(chunk))
+                result['skipped'] = len(self._objects) - i - 1
+                break
+            chunk['results'].append(obj_result)
+            chunk['writes'].extend(writes)
+        else:
+            if chunk['results']:
+                self._submit(chunk)
+                result['chunks'].append(self._chunk_result(chunk))
+
+        result['changed'] = any(c['changed'] for c in result['chunks'])
+        result['failed'] = any(c['failed'] for c in result['chunks'])
+        return result
+
+    @staticmethod
+    def _new_chunk():
+        return dict(results=[], writes=[], submitted=False, failed=False, msg=None)
+
+    @staticmethod
+    def _fail(chunk, msg):
+        chunk.update(failed=True, msg=msg)
+        # Nothing of the chunk is applied
+        for obj_result in chunk['results']:
+            obj_result['changed'] = False
+
+    @staticmethod
+    def _plan(obj):
+        """Compute the changes of an object, and return its result and the writes it queued."""
+        obj._deferred_writes = []
+        try:
+            return obj.flush(), obj._deferred_writes
+        except Exception as exc:
+            return dict(changed=False, failed=True, msg=str(exc)), []
+        finally:
+            obj._deferred_writes = None
+
+    def _submit(self, chunk):
+        """Submit the writes of the chunk in a single transaction."""
+        chunk['submitted'] = True
+        if not chunk['writes']:
+            return
+
+        from f5.bigip.contexts import TransactionContextManager
+
+        try:
+            tx = self._client.mgmt_root.tm.transactions.transaction
+            with TransactionContextManager(tx):
+                for write in chunk['writes']:
+                    write()
+        except Exception as exc:
+            self._fail(chunk, 'The transaction failed: {0}'.format(str(exc)))
+
+    @staticmethod
+    def _chunk_result(chunk):
+        return dict(objects=len(chunk['results']),
+                    writes=len(chunk['writes']),
+                    changed=not chunk['failed'] and any(r.get('changed') for r in chunk['results']),
+                    failed=chunk['failed'],
+                    msg=chunk['msg'],
+                    results=chunk['results'])
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent caches for the F5 Ansible Module
+
+Ansible starts a new Python process for every task, so the state worth keeping between tasks (eg authentication
+tokens) is stored in small JSON files, locked while they are read or written by one of the forks. The state only
+useful within a process is kept in memory.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.exceptions import HTTPError
+
+# File locking is only available on POSIX systems
+try:
+    import fcntl
+
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.ansible', 'f5')
+
+
+def get_cache_dir(provider):
+    """Get the cache directory of a provider, creating it if needed."""
+    path = os.path.expanduser(provider.get('f5_cache_dir') or DEFAULT_CACHE_DIR)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            # Created by another fork in the meantime
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an exclusive (or shared) lock on a file for the duration of the block."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if HAS_FCNTL:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield fd
+    finally:
+        if HAS_FCNTL:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class F5FileCache(object):
+    """Dictionary persisted in a local JSON file and shared across processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _dump(self, data):
+        # Write to a temporary file first, so that readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key, default=None):
+        with file_lock(self.lock_path, shared=True):
+            return self._load().get(key, default)
+
+    def set(self, key, value):
+        with self.transaction() as data:
+            data[key] = value
+
+    def delete(self, key):
+        with self.transaction() as data:
+            data.pop(key, None)
+
+    @contextmanager
+    def transaction(self):
+        """Load the whole cache for modification and save it back at the end of the block."""
+        with file_lock(self.lock_path):
+            data = self._load()
+            yield data
+            self._dump(data)
+
+
+class F5TokenCache(F5FileCache):
+    """Authentication tokens of the F5 systems, with their expiration time"""
+
+    # Tokens are refreshed this many seconds before they expire
+    REFRESH_MARGIN = 120
+
+    def __init__(self, cache_dir):
+        super(F5TokenCache, self).__init__(os.path.join(cache_dir, 'tokens.json'))
+
+    def get_token(self, key):
+        """Get a token that is still valid for a while, or None."""
+        entry = self.get(key)
+        if entry is None or entry.get('expiration') is None:
+            return None
+        if entry['expiration'] - self.REFRESH_MARGIN <= time.time():
+            return None
+        return entry
+
+    def set_token(self, key, token, expiration):
+        with self.transaction() as data:
+            # Purge the expired tokens at the same time
+            now = time.time()
+            for k in [k for k, v in data.items() if v.get('expiration', 0) <= now]:
+                del data[k]
+            data[key] = {'token': token, 'expiration': expiration}
+
+
+class F5CapabilityCache(F5FileCache):
+    """Capabilities of the F5 systems (version, provisioned modules, supported endpoints), with their expiration time"""
+
+    def __init__(self, cache_dir):
+        super(F5CapabilityCache, self).__init__(os.path.join(cache_dir, 'capabilities.json'))
+
+    def get_capabilities(self, key):
+        """Get the capabilities of a device and their expiration time, or None if they expired."""
+        entry = self.get(key)
+        if entry is None or entry.get('expiration', 0) <= time.time():
+            return None
+        return entry
+
+    def set_capabilities(self, key, capabilities, expiration):
+        with self.transaction() as data:
+            # Purge the expired capabilities at the same time
+            now = time.time()
+            for k in [k for k, v in data.items() if v.get('expiration', 0) <= now]:
+                del data[k]
+            data[key] = {'capabilities': capabilities, 'expiration': expiration}
+
+
+class F5GenerationCache(object):
+    """Fingerprint of the params and generation of the resources after their last flush, for one F5 system
+
+    Every change is appended to a local file of JSON lines (the last line of a resource wins), so that recording a
+    resource costs the same however many resources are cached. The file is loaded once per process, and compacted
+    when most of its lines are outdated.
+    """
+
+    # Entries loaded by this process, per file
+    _entries = {}
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir, hostname, port):
+        device = re.sub(r'[^\w.-]', '_', '{0}_{1}'.format(hostname, port))
+        self.path = os.path.join(cache_dir, 'generations-{0}.jsonl'.format(device))
+        self.lock_path = self.path + '.lock'
+
+    def get(self, key):
+        """Get the fingerprint and generation of a resource, or None."""
+        return self._get_entries().get(key)
+
+    def set(self, key, fingerprint, generation):
+        self._append(key, {'fingerprint': fingerprint, 'generation': generation})
+
+    def delete(self, key):
+        if key in self._get_entries():
+            self._append(key, None)
+
+    def _append(self, key, entry):
+        entries = self._get_entries()
+        if entries.get(key) == entry:
+            return
+
+        with file_lock(self.lock_path):
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'entry': entry}) + '\n')
+
+        with F5GenerationCache._lock:
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+
+    def _get_entries(self):
+        with F5GenerationCache._lock:
+            entries = F5GenerationCache._entries.get(self.path)
+        if entries is not None:
+            return entries
+
+        with file_lock(self.lock_path):
+            entries, lines = self._read()
+            if lines > 2 * len(entries) + 100:
+                self._compact(entries)
+
+        with F5GenerationCache._lock:
+            return F5GenerationCache._entries.setdefault(self.path, entries)
+
+    def _read(self):
+        entries = {}
+        lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partial line of an interrupted process
+                        continue
+                    if record['entry'] is None:
+                        entries.pop(record['key'], None)
+                    else:
+                        entries[record['key']] = record['entry']
+        except (IOError, OSError):
+            pass
+        return entries, lines
+
+    def _compact(self, entries):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for key, entry in entries.items():
+                    f.write(json.dumps({'key': key, 'entry': entry}) + '\n')
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+class F5CollectionIndex(object):
+    """In-memory index of whole collections loaded from an F5 system
+
+    Managing many objects of the same type costs a GET per object to check their existence and read them. Given to
+    these objects (see the 'prefetch' argument of F5BaseObject), the index loads their collection once, and answers
+    from memory until the time-to-live expires. The entries of the objects written since are discarded.
+    """
+
+    def __init__(self, ttl=60, expand_subcollections=True):
+        self.ttl = ttl
+        self.expand_subcollections = expand_subcollections
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_resource_key(res_id):
+        return res_id.get('partition'), res_id.get('subPath'), res_id['name']
+
+    def lookup(self, collection, res_id):
+        """Look up a resource in the index.
+
+        Return whether the index knows the resource, and the resource (None if it does not exist).
+        """
+        entry = self._get_entry(collection)
+        if entry is None:
+            return False, None
+
+        key = self.get_resource_key(res_id)
+        if key in entry['discarded']:
+            return False, None
+        if key in entry['items']:
+            return True, entry['items'][key]
+        # Without a partition, the resource may be indexed with the default one
+        return key[0] is not None, None
+
+    def discard(self, collection, res_id):
+        """Forget a resource, so that it is read from the F5 system next time (eg after it is written)."""
+        with self._lock:
+            entry = self._collections.get(collection._meta_data['uri'])
+            if entry is not None and entry['items'] is not None:
+                key = self.get_resource_key(res_id)
+                entry['items'].pop(key, None)
+                entry['discarded'].add(key)
+
+    def invalidate(self, collection=None):
+        """Forget a whole collection (or all of them)."""
+        with self._lock:
+            if collection is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(collection._meta_data['uri'], None)
+
+    def _get_entry(self, collection):
+        uri = collection._meta_data['uri']
+
+        with self._lock:
+            entry = self._collections.get(uri)
+            if entry is not None and entry['expiration'] > time.time():
+                return entry if entry['items'] is not None else None
+
+        items = self._load(collection)
+        entry = {'expiration': time.time() + self.ttl, 'items': items, 'discarded': set()}
+        with self._lock:
+            self._collections[uri] = entry
+        return entry if items is not None else None
+
+    def _load(self, collection):
+        """Load and index a collection, or return None if its items are not resources."""
+        if self.expand_subcollections:
+            try:
+                resources = collection.get_collection(requests_params={'params': 'expandSubcollections=true'})
+            except HTTPError as exc:
+                # Not supported by this endpoint
+                if exc.response is None or exc.response.status_code != 400:
+                    raise
+                resources = collection.get_collection()
+        else:
+            resources = collection.get_collection()
+
+        items = {}
+        for resource in resources:
+            if isinstance(resource, dict):
+                return None
+            res_id = {'name': resource.name,
+                      'partition': getattr(resource, 'partition', None),
+                      'subPath': getattr(resource, 'subPath', None)}
+            items[self.get_resource_key(res_id)] = resource
+        return items
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Executors for the F5 Ansible Module
+
+These classes are meant for the tools importing this library directly (eg cluster-wide rollouts and audits), to flush
+F5 objects concurrently.
+"""
+
+import collections
+import re
+import threading
+import time
+
+from ansible.module_utils.six import iteritems, string_types
+from ansible.module_utils.six.moves import queue
+
+from ansible_common_f5.base import AnsibleF5Error
+
+# Suffix of the names referring to a resource with a port (eg the pool members 'node:80' or 'fe80::1.80')
+PORT_SUFFIX_PAT = re.compile(r'([:.])(\d+|any)$')
+
+
+def _strip_port(name):
+    """Remove the port from a name referring to a resource with a port (eg 'node' for 'node:80')."""
+    match = PORT_SUFFIX_PAT.search(name)
+    if match is None:
+        return name
+    base = name[:match.start()]
+    # A dot only separates the port of an IPv6 address, not the last byte of an IPv4 one (eg '10.0.0.1')
+    if match.group(1) == '.' and ':' not in base:
+        return name
+    return base
+
+
+class F5MultiDeviceExecutor(object):
+    """Flush the same F5 object on many F5 systems in parallel
+
+    Each device is handled by one of max_workers threads, reusing the pooled session of its provider. A device that
+    fails, or does not finish within timeout seconds of the start of its flush, is reported as failed (with timed_out)
+    without affecting the others.
+
+    The requests sent to the devices time out as well (see f5_request_timeout), so that the flush of a hung device
+    ends. Until then, its thread is abandoned and replaced, so that the queued devices keep being flushed; its flush
+    may still change the device after it was reported as timed out.
+    """
+
+    # Interval between the checks of the timeouts
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, max_workers=8, timeout=None):
+        if max_workers < 1:
+            raise AnsibleF5Error("The number of workers must be a positive number.")
+        self._max_workers = max_workers
+        self._timeout = timeout
+
+    def run(self, providers, obj_class, params):
+        """Flush an object of class obj_class, created with params, on the F5 system of each provider.
+
+        Return the aggregated result: whether something changed or failed, and the result of each device (in the
+        order of the providers).
+        """
+        results = [None] * len(providers)
+        started = [None] * len(providers)
+        lock = threading.Lock()
+
+        tasks = queue.Queue()
+        for i, provider in enumerate(providers):
+            tasks.put((i, provider))
+
+        def worker():
+            while True:
+                try:
+                    i, provider = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                with lock:
+                    started[i] = time.time()
+                result = self._flush(provider, obj_class, params)
+                with lock:
+                    if results[i] is not None:
+                        # Timed out, a new thread took over this one
+                        return
+                    results[i] = result
+
+        def start_worker():
+            thread = threading.Thread(target=worker)
+            # A device that timed out must not prevent the process from exiting
+            thread.daemon = True
+            thread.start()
+
+        for x in range(min(self._max_workers, len(providers))):
+            start_worker()
+
+        while True:
+            with lock:
+                now = time.time()
+                for i, provider in enumerate(providers):
+                    if results[i] is None and self._timeout is not None and started[i] is not None \
+                            and now - started[i] > self._timeout:
+                        results[i] = self._timeout_failure(provider, now - started[i])
+                        start_worker()
+                if all(r is not None for r in results):
+                    break
+            time.sleep(self.POLL_INTERVAL)
+
+        return dict(changed=any(r['changed'] for r in results),
+                    failed=any(r['failed'] for r in results),
+                    results=results)
+
+    def _flush(self, provider, obj_class, params):
+        start = time.time()
+        try:
+            kwargs = dict(params)
+            kwargs.update(provider)
+            if self._timeout is not None and not kwargs.get('f5_request_timeout'):
+                kwargs['f5_request_timeout'] = self._timeout
+            result = obj_class(**kwargs).flush()
+        except Exception as exc:
+            return self._failure(provider, str(exc), time.time() - start)
+
+        result.update(host=provider['f5_hostname'], failed=False, elapsed=time.time() - start)
+        return result
+
+    @staticmethod
+    def _failure(provider, msg, elapsed):
+        return dict(host=provider['f5_hostname'], changed=False, failed=True, msg=msg, elapsed=elapsed)
+
+    def _timeout_failure(self, provider, elapsed):
+        msg = 'Timed out after {0} seconds. The flush is still running and may still change the device.'.format(
+            self._timeout)
+        result = self._failure(provider, msg, elapsed)
+        result['timed_out'] = True
+        return result
+
+
+class F5DependencyScheduler(object):
+    """Flush many F5 named objects of the same F5 system concurrently, in the order of their references
+
+    An object depends on the other objects whose name (or full path) appears in its reference params (see
+    _reference_params), eg a virtual server on its pool and profiles, or a pool on the nodes of its members. The
+    other params (eg a description) are free text and never make a dependency.
+
+    The objects to create or update are flushed first, each one after its dependencies; then the objects to delete,
+    each one before its dependencies. The independent objects are flushed by up to max_workers threads, sharing the
+    pooled session of the F5 system.
+
+    The dependents of an object that fails are skipped. The objects in a cycle of references are flushed one by one
+    at the end.
+    """
+
+    def __init__(self, max_workers=8):
+        if max_workers < 1:
+            raise AnsibleF5Error("The number of workers must be a positive number.")
+        self._max_workers = max_workers
+
+    def run(self, objects):
+        """Flush the objects.
+
+        Return the aggregated result: whether something changed or failed, and the result of each object (in the
+        order of the objects).
+        """
+        objects = list(objects)
+        results = [None] * len(objects)
+        dependencies = self.get_dependencies(objects)
+
+        # Reversed dependencies for the deletes
+        dependents = collections.defaultdict(set)
+        for i, deps in iteritems(dependencies):
+            for j in deps:
+                dependents[j].add(i)
+
+        present = [i for i, obj in enumerate(objects) if obj._state != 'absent']
+        absent = [i for i, obj in enumerate(objects) if obj._state == 'absent']
+        self._run_phase(objects, present, dependencies, results)
+        self._run_phase(objects, absent, dependents, results)
+
+        return dict(changed=any(r['changed'] for r in results),
+                    failed=any(r['failed'] for r in results),
+                    results=results)
+
+    @classmethod
+    def get_dependencies(cls, objects):
+        """Get the indexes of the objects each object depends on (by index)."""
+        paths = dict((cls._get_full_path(obj), i) for i, obj in enumerate(objects))
+        dependencies = {}
+
+        for i, obj in enumerate(objects):
+            partition = obj._params.get('partition') or 'Common'
+            deps = set()
+            for value in cls._iter_references(obj):
+                for name in set([value, _strip_port(value)]):
+                    if name.startswith('/'):
+                        candidates = [name]
+                    else:
+                        # Unqualified names are looked up in the partition of the object, then in Common
+                        candidates = ['/{0}/{1}'.format(partition, name), '/Common/{0}'.format(name)]
+                    for candidate in candidates:
+                        j = paths.get(candidate)
+                        if j is not None and j != i:
+                            deps.add(j)
+                            break
+            dependencies[i] = deps
+
+        return dependencies
+
+    @staticmethod
+    def _get_full_path(obj):
+        res_id = obj._get_resource_id_from_params()
+        parts = [res_id.get('partition', 'Common'), res_id.get('subPath'), res_id['name']]
+        return '/' + '/'.join(p for p in parts if p is not None)
+
+    @staticmethod
+    def _iter_references(obj):
+        """Iterate over the names in the reference params of an object.
+
+        In the dicts of these params (eg the members of a pool), only the name and the reference params are names.
+        """
+        reference_params = obj._reference_params
+        stack = [v for k, v in iteritems(obj._params) if k in reference_params]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, string_types):
+                yield value
+            elif isinstance(value, dict):
+                stack.extend(v for k, v in iteritems(value) if k == 'name' or k in reference_params)
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+
+    def _run_phase(self, objects, indexes, before, results):
+        """Flush the objects of the indexes, each one after the objects it must wait for (before)."""
+        if not indexes:
+            return
+
+        phase = set(indexes)
+        waiting = dict((i, set(before.get(i, ())) & phase) for i in indexes)
+        blocking = collections.defaultdict(set)
+        for i, deps in iteritems(waiting):
+            for j in deps:
+                blocking[j].add(i)
+
+        tasks = queue.Queue()
+        done = queue.Queue()
+
+        def worker():
+            while True:
+                i = tasks.get()
+                if i is None:
+                    return
+                done.put((i, self._flush(objects[i])))
+
+        workers = min(self._max_workers, len(indexes))
+        for x in range(workers):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+
+        ready = [i for i in indexes if not waiting[i]]
+        running = 0
+        while ready or running:
+            for i in ready:
+                tasks.put(i)
+            running += len(ready)
+            ready = []
+
+            i, result = done.get()
+            running -= 1
+            results[i] = result
+
+            for k in sorted(blocking[i]):
+                waiting[k].discard(i)
+                if result['failed']:
+                    self._skip(objects, k, blocking, results)
+                elif not waiting[k] and results[k] is None:
+                    ready.append(k)
+
+        for x in range(workers):
+            tasks.put(None)
+
+        # The objects in a cycle of references
+        for i in indexes:
+            if results[i] is None:
+                results[i] = self._flush(objects[i])
+
+    def _skip(self, objects, i, blocking, results):
+        """Skip an object, and the objects waiting for it."""
+        stack = [i]
+        while stack:
+            k = stack.pop()
+            if results[k] is None:
+                results[k] = dict(name=self._get_full_path(objects[k]), changed=False, failed=True, elapsed=0,
+                                  msg='Skipped: an object it depends on failed.')
+                stack.extend(blocking[k])
+
+    def _flush(self, obj):
+        start = time.time()
+        result = dict(name=self._get_full_path(obj), changed=False, failed=False)
+        try:
+            result.update(obj.flush())
+        except Exception as exc:
+            result.update(failed=True, msg=str(exc))
+        result['elapsed'] = time.time() - start
+        return result
@@ -18,17 +18,11 @@
 """Ansible Common Utility Module for F5 iWorkflow
 """
 
-import time
+from ansible_common_f5.base import AnsibleF5Error, F5BaseClient, F5NamedBaseObject, F5UnnamedBaseObject, has_f5sdk
+from ansible_common_f5.tasks import F5TaskPoller
 
-from ansible_common_f5.base import AnsibleF5Error, F5BaseClient, F5NamedBaseObject, F5UnnamedBaseObject
-
-# Make sure the f5-sdk is installed on the host
-try:
-    from f5.bigip import ManagementRoot as iWfMgmtRoot
-
-    HAS_F5SDK = True
-except ImportError:
-    HAS_F5SDK = False
+# Make sure the f5-sdk is installed on the host (imported when connecting)
+HAS_F5SDK = has_f5sdk()
 
 
 class F5iWorkflowClient(F5BaseClient):
@@ -37,53 +31,49 @@ class F5iWorkflowClient(F5BaseClient):
     It provides an interface to a single F5 iWorkflow system.
     """
 
+    _token_type = 'local'
+
     def __init__(self, **kwargs):
         if not HAS_F5SDK:
-            raise AnsibleF5Error("The python f5-sdk module is required. Try 'pip install f5-sdk'.")
-        self.provider = kwargs.get('provider', None)
+            raise AnsibleF5Error("The python f5-sdk module (3.0.15 or later) is required. Try 'pip install -U f5-sdk'.")
+        super(F5iWorkflowClient, self).__init__(**kwargs)
 
-    @property
-    def mgmt_root(self):
-        err = None
-        retries = self.provider.get('f5_retries', 3)
-        timeout = self.provider.get('f5_timeout', 10)
-
-        for x in range(retries):
-            try:
-                return iWfMgmtRoot(
-                    self.provider['f5_hostname'],
-                    self.provider['f5_username'],
-                    self.provider['f5_password'],
-                    port=self.provider['f5_port'],
-                    verify=self.provider['f5_verify'],
-                    token='local'
-                )
-            except Exception as exc:
-                err = exc
-                time.sleep(timeout)
-
-        err_msg = 'Unable to connect to host {0} on port {1}.'.format(self.provider['f5_hostname'],
-                                                                      self.provider['f5_port'])
-        if err is not None:
-            err_msg += ' The error message was "{0}".'.format(str(err))
-        raise AnsibleF5Error(err_msg)
+    def _new_mgmt_root(self, **kwargs):
+        from f5.bigip import ManagementRoot as iWfMgmtRoot
 
-    @property
-    def _system_version(self):
-        raise NotImplemented
+        return iWfMgmtRoot(
+            self.provider['f5_hostname'],
+            self.provider['f5_username'],
+            self.provider['f5_password'],
+            port=self.provider['f5_port'],
+            verify=self.provider['f5_verify'],
+            **kwargs
+        )
+
+    def task_poller(self, **kwargs):
+        """Get a poller for the asynchronous tasks of the iWorkflow system (see F5TaskPoller)."""
+        return F5TaskPoller(self, **kwargs)
 
 
 class F5iWorkflowNamedObject(F5NamedBaseObject):
     """Base class for all F5 iWorkflow named objects"""
 
+    @property
+    def _client(self):
+        return F5iWorkflowClient(provider=self._provider)
+
     @property
     def _api(self):
-        return F5iWorkflowClient(provider=self._provider).mgmt_root
+        return self._client.mgmt_root
 
 
 class F5iWorkflowUnnamedObject(F5UnnamedBaseObject):
     """Base class for all F5 iWorkflow unnamed objects"""
 
+    @property
+    def _client(self):
+        return F5iWorkflowClient(provider=self._provider)
+
     @property
     def _api(self):
-        return F5iWorkflowClient(provider=self._provider).mgmt_root
+        return self._client.mgmt_root
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Instrumentation of the F5 Ansible Module
+
+The time spent in each phase of a flush (login, exists, read, diff, write), the HTTP requests sent and the bytes
+transferred, and the retries are recorded in the metrics collected by the running thread (see collect_metrics).
+Nothing is recorded when no metrics are collected.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+LOG = logging.getLogger('ansible_common_f5')
+
+_local = threading.local()
+
+
+class F5Metrics(object):
+    """Timings (in seconds) of the phases and counters of the calls to the F5 systems"""
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        return dict(timings=dict(self.timings), counters=dict(self.counters))
+
+
+def _get_active_metrics():
+    return getattr(_local, 'metrics', ())
+
+
+@contextmanager
+def collect_metrics():
+    """Collect the metrics of the calls made by the running thread for the duration of the block.
+
+    The blocks may be nested, the calls are recorded in the metrics of all of them.
+    """
+    metrics = F5Metrics()
+    _local.metrics = _get_active_metrics() + (metrics,)
+    try:
+        yield metrics
+    finally:
+        _local.metrics = tuple(m for m in _local.metrics if m is not metrics)
+
+
+def incr(name, value=1):
+    """Increment a counter of the collected metrics."""
+    for metrics in _get_active_metrics():
+        metrics.incr(name, value)
+
+
+@contextmanager
+def timed(phase):
+    """Record the time spent in the block as a phase (including the time of the phases nested in it)."""
+    active_metrics = _get_active_metrics()
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        for metrics in active_metrics:
+            metrics.add_time(phase, elapsed)
+
+
+def record_response(response, *args, **kwargs):
+    """Response hook of the requests sessions, counting the requests sent and the bytes transferred."""
+    if _get_active_metrics():
+        body = response.request.body
+        incr('requests')
+        incr('bytes_sent', len(body) if body else 0)
+        incr('bytes_received', len(response.content or b''))
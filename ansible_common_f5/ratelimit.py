@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rate limiting of the requests sent to the F5 systems
+
+With many forks, the Ansible processes connecting to the same F5 system may send more requests than its REST API
+(restjavad) sustains. The limiter of a device is shared by all the processes through files of the cache directory: a
+token bucket (the number of requests per second, with bursts) and a fixed number of slots (the requests in flight at
+the same time), each slot being a lock file held for the duration of a request.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from requests.adapters import BaseAdapter
+
+from ansible_common_f5.cache import HAS_FCNTL, F5FileCache
+from ansible_common_f5.metrics import incr, timed
+
+if HAS_FCNTL:
+    import fcntl
+
+# How long (in seconds) to wait before trying the slots again, when they are all taken
+SLOT_RETRY_INTERVAL = 0.01
+
+
+class F5RateLimiter(object):
+    """Token bucket and concurrency cap of the requests sent to an F5 system, shared across processes
+
+    Up to burst requests are sent at once, then rate requests per second. No more than max_concurrency requests are
+    in flight at the same time (not enforced without file locking, ie on non-POSIX systems).
+    """
+
+    def __init__(self, cache_dir, hostname, port, rate=None, burst=None, max_concurrency=None):
+        prefix = os.path.join(cache_dir, 'ratelimit-{0}_{1}'.format(hostname, port))
+        self._bucket = F5FileCache(prefix + '.json')
+        self._slot_paths = [prefix + '.slot{0}'.format(i) for i in range(max_concurrency or 0)]
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+
+    @contextmanager
+    def request(self):
+        """Wait for the turn of a request, and hold its slot for the duration of the block."""
+        wait = self._take_token()
+        if wait > 0:
+            incr('throttled')
+            with timed('throttle'):
+                time.sleep(wait)
+
+        with self._slot():
+            yield
+
+    def _take_token(self):
+        """Take a token from the bucket, and return how long to wait until it is actually available.
+
+        A token not available yet is taken in advance (the bucket goes below zero), so that the processes waiting for
+        the following tokens are served in turn.
+        """
+        if not self.rate:
+            return 0
+
+        with self._bucket.transaction() as data:
+            now = time.time()
+            tokens = data.get('tokens', self.burst) + (now - data.get('updated', now)) * self.rate
+            tokens = min(tokens, self.burst) - 1
+            data.update(tokens=tokens, updated=now)
+        return -tokens / self.rate if tokens < 0 else 0
+
+    @contextmanager
+    def _slot(self):
+        if not self._slot_paths or not HAS_FCNTL:
+            yield
+            return
+
+        fd = self._acquire_slot()
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _acquire_slot(self):
+        """Lock the first free slot and return its file descriptor.
+
+        The locks are released by the system if their process dies, no slot is ever lost.
+        """
+        waiting = False
+        while True:
+            for path in self._slot_paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except (IOError, OSError):
+                    os.close(fd)
+
+            if not waiting:
+                waiting = True
+                incr('throttled')
+            with timed('throttle'):
+                time.sleep(SLOT_RETRY_INTERVAL)
+
+
+class F5RateLimitedAdapter(BaseAdapter):
+    """Transport adapter of a requests session, sending its requests through a rate limiter"""
+
+    def __init__(self, adapter, limiter):
+        super(F5RateLimitedAdapter, self).__init__()
+        self.adapter = adapter
+        self.limiter = limiter
+
+    def send(self, request, **kwargs):
+        with self.limiter.request():
+            return self.adapter.send(request, **kwargs)
+
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper functions for the iControl REST API of the F5 systems
+
+These functions send requests through the session of an f5-sdk Management Root, for the cases the f5-sdk resources do
+not cover (eg paging through large collections).
+"""
+
+from ansible.module_utils.six.moves.urllib.parse import parse_qsl, urlsplit, urlunsplit
+from requests.adapters import BaseAdapter
+
+# Number of items requested per page
+DEFAULT_PAGE_SIZE = 500
+
+
+class F5TimeoutAdapter(BaseAdapter):
+    """Transport adapter of a requests session, giving a timeout (in seconds) to the requests sent without one
+
+    The sessions of the f5-sdk send their requests without timeout, a request to a hung F5 system never ends.
+    """
+
+    def __init__(self, adapter, timeout):
+        super(F5TimeoutAdapter, self).__init__()
+        self.adapter = adapter
+        self.timeout = timeout
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return self.adapter.send(request, **kwargs)
+
+    def close(self):
+        self.adapter.close()
+
+
+def get_base_url(mgmt_root):
+    """Get the base URL (scheme and location) of the F5 system of a Management Root."""
+    uri = mgmt_root._meta_data['uri']
+    return uri[:uri.index('/mgmt/')]
+
+
+def get_path(uri):
+    """Get the path of a URI (eg '/mgmt/tm/ltm/pool' for 'https://localhost/mgmt/tm/ltm/pool/?ver=13.1.0')."""
+    return urlsplit(uri).path.rstrip('/')
+
+
+def get_local_url(mgmt_root, link):
+    """Get the URL of a link returned by the F5 system (which refers to it as 'localhost')."""
+    base_url = urlsplit(get_base_url(mgmt_root))
+    parts = urlsplit(link)
+    return urlunsplit((base_url.scheme, base_url.netloc, parts.path, parts.query, parts.fragment))
+
+
+def get_json(mgmt_root, path, params=None):
+    """Get a resource of the F5 system by path (eg '/mgmt/tm/sys/provision')."""
+    session = mgmt_root._meta_data['icr_session']
+    return session.get(get_base_url(mgmt_root) + path, params=params).json()
+
+
+def iter_collection(mgmt_root, uri, select=None, page_size=DEFAULT_PAGE_SIZE, params=None):
+    """Iterate over the items of a collection, loading one page at a time.
+
+    Pages are requested with $top/$skip and the nextLink returned by the F5 system is followed (BIG-IQ). Only the
+    fields in select are loaded, if given. An endpoint without paging support returns its items in a single page.
+    """
+    session = mgmt_root._meta_data['icr_session']
+
+    query = dict(params or {})
+    if select:
+        query['$select'] = ','.join(select)
+    query['$top'] = page_size
+    skip = 0
+
+    while True:
+        query['$skip'] = skip
+        body = session.get(uri, params=query).json()
+        items = body.get('items', [])
+        for item in items:
+            yield item
+
+        if items and body.get('nextLink'):
+            # The link holds the whole query
+            uri = get_local_url(mgmt_root, body['nextLink']).split('?', 1)[0]
+            query = dict(parse_qsl(urlsplit(body['nextLink']).query))
+            skip = int(query.pop('$skip', skip + len(items)))
+        elif items and 'totalItems' in body and skip + len(items) < body['totalItems']:
+            skip += len(items)
+        else:
+            return
+
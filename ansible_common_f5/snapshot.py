@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Configuration snapshots of the F5 systems
+
+A snapshot is the configuration of some collections (eg '/mgmt/tm/ltm/pool') and unnamed resources (eg
+'/mgmt/tm/sys/global-settings') of an F5 system, exported once to a local file of JSON lines (one resource per line).
+Given to F5 objects (see the 'snapshot' argument of F5BaseObject), it answers their reads so that they plan their
+changes without reading the F5 system.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from ansible.module_utils.six import iteritems
+from requests.exceptions import HTTPError
+
+from ansible_common_f5.rest import get_base_url, get_json, get_path, iter_collection
+
+
+def _get_resource_key(resource):
+    return resource.get('partition'), resource.get('subPath'), resource['name']
+
+
+class F5SnapshotResource(object):
+    """Resource of a snapshot, with the keys of its JSON representation as attributes"""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+        self._meta_data = {'uri': data.get('selfLink', '').split('?', 1)[0]}
+
+
+class F5ConfigSnapshot(object):
+    """Snapshot of the configuration of an F5 system, stored in a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.created = None
+        self._collections = {}
+        self._resources = {}
+        # Collections exported with the subcollections of their resources inlined
+        self._expanded = set()
+        if os.path.exists(path):
+            self._load()
+
+    def export(self, mgmt_root, collections=(), resources=()):
+        """Export the given collections and unnamed resources (by path) of the F5 system to the snapshot."""
+        # Stored by normalized path (eg without a trailing slash), as they are looked up
+        self._collections = {}
+        self._expanded = set()
+        for path in collections:
+            self._collections[get_path(path)], expanded = self._load_collection(mgmt_root, path)
+            if expanded:
+                self._expanded.add(get_path(path))
+        self._resources = dict((get_path(path), get_json(mgmt_root, path)) for path in resources)
+        self._dump()
+
+    def refresh(self, mgmt_root):
+        """Update the snapshot with the resources changed since its export.
+
+        Only the generation of the resources is loaded, the resources whose generation changed (and the new ones) are
+        loaded again.
+        """
+        for path, items in iteritems(self._collections):
+            refreshed = {}
+            for item in iter_collection(mgmt_root, get_base_url(mgmt_root) + path,
+                                        select=['name', 'partition', 'subPath', 'generation', 'selfLink']):
+                key = _get_resource_key(item)
+                resource = items.get(key)
+                if resource is None or resource.get('generation') != item.get('generation'):
+                    resource, expanded = self._load_resource(mgmt_root, get_path(item['selfLink']))
+                    if not expanded:
+                        self._expanded.discard(path)
+                refreshed[key] = resource
+            self._collections[path] = refreshed
+
+        for path, resource in iteritems(self._resources):
+            item = get_json(mgmt_root, path, params={'$select': 'generation'})
+            if resource.get('generation') != item.get('generation'):
+                self._resources[path] = get_json(mgmt_root, path)
+
+        self._dump()
+
+    def lookup(self, collection, res_id):
+        """Look up a resource of an f5-sdk collection in the snapshot.
+
+        Return whether the snapshot knows the resource, and the resource (None if it does not exist).
+        """
+        items = self._collections.get(get_path(collection._meta_data['uri']))
+        if items is None:
+            return False, None
+
+        key = (res_id.get('partition'), res_id.get('subPath'), res_id['name'])
+        if key in items:
+            return True, F5SnapshotResource(items[key])
+        # Without a partition, the resource may be stored with the default one
+        return key[0] is not None, None
+
+    def discard(self, collection, res_id):
+        # The objects do not write in plan mode, the snapshot stays as exported
+        pass
+
+    def has_subcollections(self, uri):
+        """Tell whether the subcollections of a resource (by URI) are inlined in the snapshot.
+
+        Then, a subcollection without items in the resource (eg the members of a pool) is empty.
+        """
+        return get_path(uri).rsplit('/', 1)[0] in self._expanded
+
+    def get_resource(self, uri):
+        """Get an unnamed resource from the snapshot, or None if it was not exported."""
+        resource = self._resources.get(get_path(uri))
+        return F5SnapshotResource(resource) if resource is not None else None
+
+    @staticmethod
+    def _load_collection(mgmt_root, path):
+        """Load the resources of a collection, and tell whether their subcollections are inlined."""
+        uri = get_base_url(mgmt_root) + path
+        expanded = True
+        try:
+            items = list(iter_collection(mgmt_root, uri, params={'expandSubcollections': 'true'}))
+        except HTTPError as exc:
+            # Not supported by this endpoint
+            if exc.response is None or exc.response.status_code != 400:
+                raise
+            items = list(iter_collection(mgmt_root, uri))
+            expanded = False
+        return dict((_get_resource_key(item), item) for item in items), expanded
+
+    @staticmethod
+    def _load_resource(mgmt_root, path):
+        try:
+            return get_json(mgmt_root, path, params={'expandSubcollections': 'true'}), True
+        except HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 400:
+                raise
+            return get_json(mgmt_root, path), False
+
+    def _load(self):
+        with open(self.path) as f:
+            header = json.loads(f.readline())
+            self.created = header['created']
+            self._expanded = set(header.get('expanded', ()))
+            for line in f:
+                entry = json.loads(line)
+                if 'collection' in entry:
+                    items = self._collections.setdefault(get_path(entry['collection']), {})
+                    if entry['resource'] is not None:
+                        items[_get_resource_key(entry['resource'])] = entry['resource']
+                else:
+                    self._resources[get_path(entry['path'])] = entry['resource']
+
+    def _dump(self):
+        self.created = time.time()
+        # Write to a temporary file first, so that readers never see a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps({'created': self.created, 'expanded': sorted(self._expanded)}) + '\n')
+                for path, items in iteritems(self._collections):
+                    if not items:
+                        # An empty collection is known as well
+                        f.write(json.dumps({'collection': path, 'resource': None}) + '\n')
+                    for resource in items.values():
+                        f.write(json.dumps({'collection': path, 'resource': resource}, separators=(',', ':')) + '\n')
+                for path, resource in iteritems(self._resources):
+                    f.write(json.dumps({'path': path, 'resource': resource}, separators=(',', ':')) + '\n')
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
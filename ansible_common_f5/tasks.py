@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Polling of the asynchronous tasks of the F5 BIG-IQ and iWorkflow systems
+
+Many operations (eg deployments, device discovery) answer with a task resource (eg
+/mgmt/cm/global/tasks/deploy-configuration/<id>) whose status must be polled until it is finished.
+"""
+
+import time
+
+from ansible.module_utils.six import iteritems
+from requests.exceptions import HTTPError
+
+from ansible_common_f5.base import AnsibleF5Error
+from ansible_common_f5.rest import get_json, get_path
+
+# Status of the tasks when they are done
+F5_TASK_FINISHED_STATUSES = frozenset(['FINISHED', 'COMPLETED'])
+F5_TASK_FAILED_STATUSES = frozenset(['FAILED', 'CANCELED', 'CANCELLED', 'ERROR'])
+
+
+class F5Task(object):
+    """Task of an F5 system, tracked by an F5TaskPoller"""
+
+    def __init__(self, link, callback=None, interval=1.0):
+        self.path = get_path(link)
+        self.collection, self.id = self.path.rsplit('/', 1)
+        self.callback = callback
+        self.status = None
+        self.data = None
+        self.interval = interval
+        self.next_poll = time.time() + interval
+
+    @property
+    def done(self):
+        return self.status in F5_TASK_FINISHED_STATUSES or self.status in F5_TASK_FAILED_STATUSES
+
+    @property
+    def failed(self):
+        return self.status in F5_TASK_FAILED_STATUSES
+
+
+class F5TaskPoller(object):
+    """Poll many tasks of an F5 system until they are done
+
+    The tasks of the same collection are polled together, with a single query ($filter on their ids) per batch of
+    batch_size tasks. Each task is first polled after min_interval seconds, then less and less often (the interval
+    grows by backoff, up to max_interval): short tasks finish early, long ones cost few polls.
+    """
+
+    def __init__(self, client, min_interval=0.5, max_interval=10.0, backoff=1.5, batch_size=20):
+        self._client = client
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._batch_size = batch_size
+        self._tasks = []
+        # Collections rejecting $filter, whose tasks are polled one by one
+        self._unfiltered = set()
+
+    @property
+    def pending(self):
+        return [task for task in self._tasks if not task.done]
+
+    def add(self, task, callback=None):
+        """Track a task, given by its link (or its resource, eg the response that created it).
+
+        The callback, if any, is called with the task when it is done.
+        """
+        if isinstance(task, dict):
+            task = task['selfLink']
+        task = F5Task(task, callback=callback, interval=self._min_interval)
+        self._tasks.append(task)
+        return task
+
+    def poll(self):
+        """Poll the pending tasks that are due, and return the tasks that are done since."""
+        now = time.time()
+        due = {}
+        for task in self.pending:
+            if task.next_poll <= now:
+                due.setdefault(task.collection, []).append(task)
+
+        done = []
+        for collection, tasks in iteritems(due):
+            for i in range(0, len(tasks), self._batch_size):
+                done.extend(self._poll_batch(collection, tasks[i:i + self._batch_size]))
+        return done
+
+    def wait_any(self, timeout=None):
+        """Wait until at least one pending task is done, and return the tasks that are done."""
+        return self._wait(lambda done: bool(done) or not self.pending, timeout)
+
+    def wait_all(self, timeout=None):
+        """Wait until all the tasks are done, and return them."""
+        self._wait(lambda done: not self.pending, timeout)
+        return list(self._tasks)
+
+    def _wait(self, is_over, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        done = []
+        while True:
+            done.extend(self.poll())
+            if is_over(done):
+                return done
+
+            next_poll = min(task.next_poll for task in self.pending)
+            if deadline is not None and next_poll > deadline:
+                raise AnsibleF5Error("Timed out waiting for {0} tasks.".format(len(self.pending)))
+            time.sleep(max(next_poll - time.time(), 0))
+
+    def _poll_batch(self, collection, tasks):
+        mgmt_root = self._client.mgmt_root
+
+        done = []
+        if collection not in self._unfiltered:
+            query = ' or '.join("id eq '{0}'".format(task.id) for task in tasks)
+            try:
+                body = get_json(mgmt_root, collection, params={'$filter': query})
+                items = dict((item.get('id'), item) for item in body.get('items', []))
+                done = [task for task in tasks if task.id in items and self._update(task, items[task.id])]
+                # The tasks missing from the response are polled one by one (eg to tell whether they still exist)
+                tasks = [task for task in tasks if task.id not in items]
+            except HTTPError as exc:
+                if exc.response is None or exc.response.status_code != 400:
+                    raise
+                self._unfiltered.add(collection)
+
+        for task in tasks:
+            try:
+                data = get_json(mgmt_root, task.path)
+            except HTTPError as exc:
+                if exc.response is None or exc.response.status_code != 404:
+                    raise
+                data = {'status': 'FAILED', 'message': 'The task does not exist anymore.'}
+            if self._update(task, data):
+                done.append(task)
+        return done
+
+    def _update(self, task, data):
+        """Update a task with its polled resource, and tell whether it is done."""
+        task.data = data
+        task.status = data.get('status')
+
+        if task.done:
+            if task.callback is not None:
+                task.callback(task)
+            return True
+
+        task.interval = min(task.interval * self._backoff, self._max_interval)
+        task.next_poll = time.time() + task.interval
+        return False
@@ -19,10 +19,58 @@
 """
 
 import collections
+import numbers
 import re
+import threading
 
 from ansible.module_utils.six import iteritems, iterkeys, string_types
 
+try:
+    from collections.abc import Iterable, Mapping, Set
+except ImportError:
+    from collections import Iterable, Mapping, Set
+
+# Keys of the references added by the F5 system to the resources, ignored when comparing them
+F5_REFERENCE_KEYS = frozenset(['nameReference', 'poolReference'])
+
+# Number of names remembered by the naming convention functions
+NAMING_CACHE_SIZE = 4096
+
+CAMEL_PAT = re.compile(r'([A-Z])')
+UNDER_PAT = re.compile(r'_([a-z])')
+
+
+# Memoization of the naming convention functions (not available in Python 2)
+try:
+    from functools import lru_cache
+except ImportError:
+    def lru_cache(maxsize):
+        """Decorator memoizing a function of one hashable argument, with a bounded cache of the least recently used."""
+        def decorator(fn):
+            cache = collections.OrderedDict()
+            lock = threading.Lock()
+
+            def wrapper(arg):
+                with lock:
+                    try:
+                        # Move the hit to the end (most recently used)
+                        result = cache.pop(arg)
+                        cache[arg] = result
+                        return result
+                    except KeyError:
+                        pass
+                result = fn(arg)
+                with lock:
+                    cache[arg] = result
+                    if len(cache) > maxsize:
+                        cache.popitem(last=False)
+                return result
+
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__name__ = fn.__name__
+            return wrapper
+        return decorator
+
 
 def missing_required_params(rq_set, params):
     key_set = set(list(iterkeys(params)))
@@ -32,35 +80,243 @@ def missing_required_params(rq_set, params):
         return list(required_minus_received)
 
 
+@lru_cache(maxsize=NAMING_CACHE_SIZE)
 def camel_to_snake(name):
-    camel_pat = re.compile(r'([A-Z])')
-    return camel_pat.sub(lambda x: '_' + x.group(1).lower(), name)
+    return CAMEL_PAT.sub(lambda x: '_' + x.group(1).lower(), name)
 
 
+@lru_cache(maxsize=NAMING_CACHE_SIZE)
 def snake_to_camel(name):
-    under_pat = re.compile(r'_([a-z])')
-    return under_pat.sub(lambda x: x.group(1).upper(), name)
+    return UNDER_PAT.sub(lambda x: x.group(1).upper(), name)
 
 
-def change_dict_naming_convention(d, convert_fn):
+def change_dict_naming_convention(d, convert_fn, recursive=False):
+    """Change the naming convention of the keys of a dict.
+
+    If recursive, the keys of the dicts nested in the values (directly or in lists) are changed as well.
+    """
     new = {}
 
     for k, v in iteritems(d):
         new_v = v
+        if recursive:
+            new_v = _change_value_naming_convention(v, convert_fn)
         new[convert_fn(k)] = new_v
 
     return new
 
 
-def convert(data):
+def _change_value_naming_convention(value, convert_fn):
+    if isinstance(value, Mapping):
+        return change_dict_naming_convention(value, convert_fn, recursive=True)
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_change_value_naming_convention(v, convert_fn) for v in value)
+    else:
+        return value
+
+
+def _walk(data, visit_leaf, build_mapping, build_sequence, sequence_types, exclude_keys=()):
+    """Rebuild a structure bottom-up.
+
+    The structure is walked iteratively, so that deep structures cannot hit the recursion limit. The leaves are
+    turned into visit_leaf(leaf), the mappings into build_mapping(mapping, keys, values) and the sequences into
+    build_sequence(sequence, items), where the keys, values and items are already rebuilt. The excluded keys are
+    dropped from the mappings.
+    """
+    def is_leaf(node):
+        return isinstance(node, string_types) or not isinstance(node, (Mapping,) + sequence_types) \
+            or isinstance(node, (bytes, bytearray))
+
+    if is_leaf(data):
+        return visit_leaf(data)
+
+    root = []
+    # Frames: [node, children, index of the next child, rebuilt children, where to put the rebuilt node]
+    stack = [[data, None, 0, [], root]]
+
+    while stack:
+        frame = stack[-1]
+        node, children = frame[0], frame[1]
+
+        if children is None:
+            if isinstance(node, Mapping):
+                children = frame[1] = [x for k, v in iteritems(node) if k not in exclude_keys for x in (k, v)]
+            else:
+                children = frame[1] = list(node)
+
+        if frame[2] < len(children):
+            child = children[frame[2]]
+            frame[2] += 1
+            if is_leaf(child):
+                frame[3].append(visit_leaf(child))
+            else:
+                stack.append([child, None, 0, [], frame[3]])
+            continue
+
+        stack.pop()
+        results = frame[3]
+        if isinstance(node, Mapping):
+            frame[4].append(build_mapping(node, results[0::2], results[1::2]))
+        else:
+            frame[4].append(build_sequence(node, results))
+
+    return root[0]
+
+
+def _convert_leaf(data):
     if isinstance(data, string_types):
+        # Returns the same string if it does not change
         return str(data.strip())
-    elif isinstance(data, collections.Mapping):
-        return dict(map(convert, iteritems(data)))
-    elif isinstance(data, collections.Iterable):
-        return type(data)(map(convert, data))
-    else:
+    return data
+
+
+def _convert_mapping(data, keys, values):
+    if type(data) is dict and all(k is c for k, c in zip(keys, data)) and \
+            all(v is data[k] for k, v in zip(keys, values)):
+        return data
+    return dict(zip(keys, values))
+
+
+def _convert_sequence(data, items):
+    if type(data) in (list, tuple, set, frozenset) and all(i is c for i, c in zip(items, data)):
         return data
+    return type(data)(items)
+
+
+def convert(data):
+    """Normalize a value: strip its strings and turn its mappings into dicts.
+
+    Only the parts of the value that change are copied, the rest is returned as is.
+    """
+    return _walk(data, _convert_leaf, _convert_mapping, _convert_sequence, (Iterable,))
+
+
+def _scalar_type(value):
+    """Get the type of a scalar value as compared by has_changed."""
+    if isinstance(value, string_types):
+        return string_types
+    if isinstance(value, bool):
+        return bool
+    if isinstance(value, numbers.Integral):
+        return numbers.Integral
+    return type(value)
+
+
+def _canonicalize_leaf(data):
+    return _scalar_type(data), data
+
+
+def _canonicalize_normalized_leaf(data):
+    return _canonicalize_leaf(_convert_leaf(data))
+
+
+def _canonicalize_mapping(data, keys, values):
+    return Mapping, frozenset(zip(keys, values))
+
+
+def _canonicalize_sequence(data, items):
+    return list, frozenset(items)
+
+
+def canonicalize(data, exclude_keys=F5_REFERENCE_KEYS, normalize=False):
+    """Get a canonical and hashable form of an F5 payload value.
+
+    Two values have the same canonical form if has_changed finds no difference between them: the excluded keys are
+    dropped from the dicts, and the lists are turned into sets (order and repetition do not matter). If normalize,
+    the value is normalized (see convert) at the same time.
+    """
+    visit_leaf = _canonicalize_normalized_leaf if normalize else _canonicalize_leaf
+    return _walk(data, visit_leaf, _canonicalize_mapping, _canonicalize_sequence, (list, tuple, Set), exclude_keys)
+
+
+def has_changed(cur_val, new_val, exclude_keys=F5_REFERENCE_KEYS):
+    """Tell whether a value of an F5 payload differs from its new value.
+
+    Dicts are compared key by key, ignoring the excluded keys (eg the references added by the F5 system), and lists
+    are compared regardless of the order and repetition of their items. The comparison stops at the first difference.
+    """
+    if isinstance(new_val, Mapping):
+        if not isinstance(cur_val, Mapping):
+            return True
+        cur_keys = set(k for k in cur_val if k not in exclude_keys)
+        new_keys = set(k for k in new_val if k not in exclude_keys)
+        if cur_keys != new_keys:
+            return True
+        return any(has_changed(cur_val[k], new_val[k], exclude_keys) for k in new_keys)
+
+    if isinstance(new_val, (list, tuple, Set)):
+        if not isinstance(cur_val, (list, tuple, Set)):
+            return True
+        cur_items = set(canonicalize(v, exclude_keys) for v in cur_val)
+        new_items = set()
+        for v in new_val:
+            item = canonicalize(v, exclude_keys)
+            if item not in cur_items:
+                return True
+            new_items.add(item)
+        return len(new_items) != len(cur_items)
+
+    return _scalar_type(cur_val) is not _scalar_type(new_val) or cur_val != new_val
+
+
+def items_have_changed(cur_items, new_items, exclude_keys=F5_REFERENCE_KEYS):
+    """Tell whether the current items of a list of dicts (eg a paged subcollection) differ from the new items.
+
+    Only the fields of the new items are compared, regardless of the order and repetition of the items. The current
+    items may be an iterator: they are consumed one at a time, so that only the new items are held in memory, and the
+    comparison stops at the first difference.
+    """
+    fields = set(k for item in new_items for k in item) - exclude_keys
+    new_set = set(canonicalize(item, exclude_keys) for item in new_items)
+    cur_set = set()
+
+    for item in cur_items:
+        cur_item = canonicalize(dict((k, v) for k, v in iteritems(item) if k in fields), exclude_keys, normalize=True)
+        if cur_item not in new_set:
+            return True
+        cur_set.add(cur_item)
+
+    return len(cur_set) != len(new_set)
+
+
+def diff_items(cur_items, new_items, key='name', max_changes=None, exclude_keys=F5_REFERENCE_KEYS):
+    """Get the changes turning the current items of a list of dicts into the new items, matched by key.
+
+    Return the new items to add, the current items to remove and the current items to modify (with their changed
+    fields), or None as soon as there are more than max_changes. Only the fields of the new items are compared. The
+    current items may be an iterator: they are consumed one at a time.
+    """
+    new_by_key = collections.OrderedDict((item[key], item) for item in new_items)
+    missing_keys = set(new_by_key)
+    removed = []
+    modified = []
+
+    for cur_item in cur_items:
+        new_item = new_by_key.get(cur_item.get(key))
+        if new_item is None:
+            removed.append(cur_item)
+        else:
+            missing_keys.discard(new_item[key])
+            fields = {}
+            for k, v in iteritems(new_item):
+                if k in exclude_keys or v is None:
+                    continue
+                if k in cur_item:
+                    if has_changed(convert(cur_item[k]), v, exclude_keys):
+                        fields[k] = v
+                elif v:
+                    fields[k] = v
+            if fields:
+                modified.append((cur_item, fields))
+
+        if max_changes is not None and len(removed) + len(modified) > max_changes:
+            return None
+
+    added = [item for k, item in iteritems(new_by_key) if k in missing_keys]
+    if max_changes is not None and len(added) + len(removed) + len(modified) > max_changes:
+        return None
+
+    return dict(added=added, removed=removed, modified=modified)
 
 
 def to_lines(stdout):
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the concurrent flush of asynchronous F5 BIG-IP objects against the local mock server
+
+Flush pools concurrently (all of them at once, over at most --connections connections) through the create,
+idempotent no-op, update and delete scenarios, each one in its own event loop (asyncio.run). Report the requests
+received by the server and the total time of each scenario. Requires aiohttp.
+
+    python benchmarks/bench_aio.py [--objects 500] [--latency 0.002] [--connections 10]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ansible_common_f5.aio import F5AsyncNamedBaseObject  # noqa: E402
+from mock_server import F5MockServer  # noqa: E402
+
+
+class F5AsyncBenchPool(F5AsyncNamedBaseObject):
+    _path = '/mgmt/tm/ltm/pool'
+
+
+async def flush_all(objects):
+    return await asyncio.gather(*(obj.flush() for obj in objects))
+
+
+def run(server, name, objects):
+    """Flush the objects concurrently and print the requests and the total time."""
+    server.reset_counts()
+    start = time.time()
+    results = asyncio.run(flush_all(objects))
+    elapsed = time.time() - start
+
+    counts = server.reset_counts()
+    requests = sum(counts.values())
+    changed = sum(result['changed'] for result in results)
+    print('{0:<14} {1:>6} {2:>8} {3:>9.2f} {4:>8.2f}s  {5}'.format(
+        name, len(objects), changed, float(requests) / len(objects), elapsed,
+        ' '.join('{0}={1}'.format(k, v) for k, v in sorted(counts.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--objects', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.002, help='latency of the server, in seconds')
+    parser.add_argument('--connections', type=int, default=10, help='maximum number of connections to the server')
+    args = parser.parse_args()
+
+    F5AsyncBenchPool._max_connections = args.connections
+    server = F5MockServer(latency=args.latency)
+    server.start()
+
+    def pools(**params):
+        return [F5AsyncBenchPool(name='pool-{0}'.format(i), partition='Common', **dict(params, **server.provider))
+                for i in range(args.objects)]
+
+    try:
+        print('{0:<14} {1:>6} {2:>8} {3:>9} {4:>9}  {5}'.format(
+            'scenario', 'flushes', 'changed', 'req/flush', 'total', 'requests'))
+        run(server, 'pool create', pools(state='present', description='created', lb_method='round-robin'))
+        run(server, 'pool no-op', pools(state='present', description='created', lb_method='round-robin'))
+        run(server, 'pool update', pools(state='present', description='updated', lb_method='round-robin'))
+        run(server, 'pool delete', pools(state='absent'))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the comparison of large data-groups
+
+Compare utils.has_changed with the DeepDiff call it replaces in F5BaseObject._update, on the records of data-groups
+of increasing size (unchanged but shuffled, and with a single changed record).
+
+    python benchmarks/bench_diff.py [--sizes 100,1000,10000] [--repeat 3]
+"""
+
+import argparse
+import random
+import timeit
+
+from deepdiff import DeepDiff
+
+from ansible_common_f5.utils import has_changed
+
+
+def make_records(size):
+    return [{'name': '10.{0}.{1}.0/24'.format(i // 256, i % 256), 'data': 'pool_{0}'.format(i % 17)}
+            for i in range(size)]
+
+
+def deepdiff_changed(cur_val, new_val):
+    return bool(DeepDiff(cur_val, new_val, ignore_order=True,
+                         exclude_paths={"root['nameReference']", "root['poolReference']"}))
+
+
+def bench(fn, cur_val, new_val, repeat):
+    timer = timeit.Timer(lambda: fn(cur_val, new_val))
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{0:>8} {1:>10} {2:>12} {3:>12} {4:>8}'.format('records', 'case', 'deepdiff (s)', 'utils (s)', 'speedup'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        cur_val = make_records(size)
+
+        unchanged = list(cur_val)
+        random.shuffle(unchanged)
+        changed = list(unchanged)
+        changed[size // 2] = {'name': changed[size // 2]['name'], 'data': 'changed'}
+
+        for case, new_val in (('unchanged', unchanged), ('changed', changed)):
+            assert deepdiff_changed(cur_val, new_val) == has_changed(cur_val, new_val)
+            t_deepdiff = bench(deepdiff_changed, cur_val, new_val, args.repeat)
+            t_utils = bench(has_changed, cur_val, new_val, args.repeat)
+            print('{0:>8} {1:>10} {2:>12.4f} {3:>12.4f} {4:>7.0f}x'.format(size, case, t_deepdiff, t_utils,
+                                                                         t_deepdiff / t_utils))
+
+
+if __name__ == '__main__':
+    main()
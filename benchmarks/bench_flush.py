@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the flush of F5 BIG-IP objects against the local mock server
+
+Flush pools (named objects) through the create, idempotent no-op, update and delete scenarios, and the global
+settings (an unnamed object) through the no-op and update scenarios. Report the requests received by the server and
+the latency percentiles of the flushes for each scenario.
+
+    python benchmarks/bench_flush.py [--objects 500] [--latency 0.002] [--existing 10000] [--prefetch]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ansible_common_f5.bigip import F5BigIpNamedObject, F5BigIpUnnamedObject  # noqa: E402
+from ansible_common_f5.cache import F5CollectionIndex  # noqa: E402
+from mock_server import F5MockServer  # noqa: E402
+
+
+class F5BenchPool(F5BigIpNamedObject):
+    def _set_crud_methods(self):
+        self._methods = {
+            'create': self._api.tm.ltm.pools.pool.create,
+            'read': self._api.tm.ltm.pools.pool.load,
+            'modify': self._api.tm.ltm.pools.pool.modify,
+            'delete': self._api.tm.ltm.pools.pool.delete,
+            'exists': self._api.tm.ltm.pools.pool.exists
+        }
+
+
+class F5BenchGlobalSettings(F5BigIpUnnamedObject):
+    def _set_crud_methods(self):
+        self._methods = {
+            'read': self._api.tm.sys.global_settings.load,
+            'modify': self._api.tm.sys.global_settings.modify
+        }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def run(server, name, objects):
+    """Flush the objects one after the other and print the requests and latencies."""
+    server.reset_counts()
+    latencies = []
+    changed = 0
+    start = time.time()
+    for obj in objects:
+        flush_start = time.time()
+        changed += obj.flush()['changed']
+        latencies.append(time.time() - flush_start)
+    elapsed = time.time() - start
+
+    counts = server.reset_counts()
+    requests = sum(counts.values())
+    print('{0:<22} {1:>6} {2:>8} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>8.2f}s  {7}'.format(
+        name, len(objects), changed, float(requests) / len(objects), percentile(latencies, 50) * 1000,
+        percentile(latencies, 95) * 1000, elapsed, ' '.join('{0}={1}'.format(k, v) for k, v in sorted(counts.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--objects', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.002, help='latency of the server, in seconds')
+    parser.add_argument('--existing', type=int, default=1000, help='number of pools already on the server')
+    parser.add_argument('--prefetch', action='store_true', help='look up the pools in a prefetched index')
+    args = parser.parse_args()
+
+    server = F5MockServer(latency=args.latency)
+    server.populate('/mgmt/tm/ltm/pool', args.existing, partition='Existing')
+    server.add_singleton('/mgmt/tm/sys/global-settings', {'hostname': 'bigip1', 'guiSetup': 'enabled'})
+    server.start()
+
+    def pools(**params):
+        prefetch = F5CollectionIndex() if args.prefetch else None
+        return [F5BenchPool(name='pool-{0}'.format(i), partition='Common', prefetch=prefetch,
+                            **dict(params, **server.provider)) for i in range(args.objects)]
+
+    def global_settings(**params):
+        return [F5BenchGlobalSettings(**dict(params, **server.provider)) for x in range(args.objects)]
+
+    try:
+        # Log in once, outside of the scenarios
+        F5BenchGlobalSettings(**server.provider).flush()
+
+        print('{0:<22} {1:>6} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9}  {7}'.format(
+            'scenario', 'flushes', 'changed', 'req/flush', 'p50 (ms)', 'p95 (ms)', 'total', 'requests'))
+        run(server, 'pool create', pools(state='present', description='created', lb_method='round-robin'))
+        run(server, 'pool no-op', pools(state='present', description='created', lb_method='round-robin'))
+        run(server, 'pool update', pools(state='present', description='updated', lb_method='round-robin'))
+        run(server, 'pool delete', pools(state='absent'))
+        run(server, 'global-settings no-op', global_settings(hostname='bigip1'))
+        run(server, 'global-settings update', global_settings(hostname='bigip2'))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
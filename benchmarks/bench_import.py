@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the cold-start import of the modules
+
+Import each module in a fresh interpreter (as Ansible does for every task), then the same module followed by the
+f5-sdk resource tree (as it was imported before it was deferred to the connection).
+
+    python benchmarks/bench_import.py [--repeat 10]
+"""
+
+import argparse
+import subprocess
+import sys
+
+MODULES = ['ansible_common_f5.bigip', 'ansible_common_f5.bigiq', 'ansible_common_f5.iworkflow']
+
+EAGER_IMPORTS = 'import f5.bigip, f5.bigip.contexts'
+
+SCRIPT = '''
+import time
+start = time.time()
+{0}
+print(time.time() - start)
+'''
+
+
+def time_import(statement, repeat):
+    """Get the median time of a statement run in a fresh interpreter."""
+    times = []
+    for x in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(statement)])
+        times.append(float(output.decode('utf-8').strip()))
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('{0:<28} {1:>10} {2:>10} {3:>8}'.format('module', 'eager (s)', 'lazy (s)', 'speedup'))
+    for module in MODULES:
+        t_lazy = time_import('import {0}'.format(module), args.repeat)
+        t_eager = time_import('import {0}; {1}'.format(module, EAGER_IMPORTS), args.repeat)
+        print('{0:<28} {1:>10.3f} {2:>10.3f} {3:>7.1f}x'.format(module, t_eager, t_lazy, t_eager / t_lazy))
+
+
+if __name__ == '__main__':
+    main()
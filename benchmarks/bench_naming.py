@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the construction of the F5 objects
+
+Construct F5 objects with the memoized camel_to_snake/snake_to_camel and the per-class param schema, then with the
+previous implementation (which compiled its pattern on every call, and had no schema).
+
+    python benchmarks/bench_naming.py [--objects 10000] [--repeat 3]
+"""
+
+import argparse
+import re
+import timeit
+
+import ansible_common_f5.base
+from ansible_common_f5.base import F5BaseObject, F5NamedBaseObject, F5ParamSchema
+
+PARAMS = dict(name='vs', partition='Common', state='present', description='Virtual server',
+              destination='/Common/1.1.1.1:80', ip_protocol='tcp', pool='/Common/pool',
+              source_address_translation={'type': 'automap'},
+              profiles=['/Common/tcp', '/Common/http'], rules=['/Common/irule'], connection_limit=0,
+              fallback_persistence='/Common/source_addr', persist=[{'name': 'cookie'}], vlans_enabled=True,
+              f5_hostname='localhost', f5_username='admin', f5_password='admin')
+
+
+class F5BenchObject(F5NamedBaseObject):
+    def _set_crud_methods(self):
+        self._methods['read'] = None
+
+
+def uncached_camel_to_snake(name):
+    camel_pat = re.compile(r'([A-Z])')
+    return camel_pat.sub(lambda x: '_' + x.group(1).lower(), name)
+
+
+def uncached_snake_to_camel(name):
+    under_pat = re.compile(r'_([a-z])')
+    return under_pat.sub(lambda x: x.group(1).upper(), name)
+
+
+def construct(count):
+    for x in range(count):
+        F5BenchObject(tr={'state': 'ltm_state'}, **PARAMS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--objects', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    timer = timeit.Timer(lambda: construct(args.objects))
+    t_cached = min(timer.repeat(repeat=args.repeat, number=1))
+
+    cached = (ansible_common_f5.base.camel_to_snake, ansible_common_f5.base.snake_to_camel)
+    ansible_common_f5.base.camel_to_snake = uncached_camel_to_snake
+    ansible_common_f5.base.snake_to_camel = uncached_snake_to_camel
+    # A new schema for every object
+    get_schema = F5BaseObject.__dict__['_get_schema']
+    F5BaseObject._get_schema = classmethod(F5ParamSchema)
+    try:
+        t_uncached = min(timer.repeat(repeat=args.repeat, number=1))
+    finally:
+        ansible_common_f5.base.camel_to_snake, ansible_common_f5.base.snake_to_camel = cached
+        F5BaseObject._get_schema = get_schema
+
+    print('{0} objects: {1:.3f}s before, {2:.3f}s memoized ({3:.1f}x)'.format(args.objects, t_uncached, t_cached,
+                                                                            t_uncached / t_cached))
+
+
+if __name__ == '__main__':
+    main()
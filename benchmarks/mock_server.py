@@ -0,0 +1,317 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016-2018, Eric Jacob <erjac77@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-in for the iControl REST API of an F5 BIG-IP
+
+The server keeps its resources in memory and emulates what the f5-sdk relies on: token authentication (and basic
+authentication), the version in /mgmt/tm/sys, the CRUD of named resources (eg /mgmt/tm/ltm/pool/~Common~pool) with
+their 404s and 409s, unnamed resources, paging ($top/$skip) and projection ($select) of the collections, and a
+configurable latency. Requires Python 3 and the openssl command (to generate its certificate).
+
+    server = F5MockServer(latency=0.005)
+    server.populate('/mgmt/tm/ltm/pool', 10000)
+    server.start()
+    ...
+    server.stop()
+
+It may also run on its own:
+
+    python benchmarks/mock_server.py [--port 8443] [--latency 0.005]
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from base64 import b64decode
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlsplit
+
+VERSION = '13.1.0'
+
+TOKEN_TIMEOUT = 1200
+
+
+def _get_kind(path):
+    """Get the kind of the resources of a collection path (eg tm:ltm:pool:poolstate)."""
+    segments = path.strip('/').split('/')[1:]
+    return '{0}:{1}state'.format(':'.join(segments), segments[-1])
+
+
+def _get_resource_id(resource):
+    parts = [resource.get('partition'), resource.get('subPath'), resource['name']]
+    if parts[0] is None:
+        return resource['name']
+    return '~' + '~'.join(p for p in parts if p is not None)
+
+
+def _project(resource, select):
+    if not select:
+        return resource
+    return dict((k, v) for k, v in resource.items() if k in select)
+
+
+class F5MockServer(ThreadingMixIn, HTTPServer):
+    """In-memory iControl REST server, counting the requests it receives"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, username='admin', password='admin', latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), F5MockHandler)
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.collections = collections.defaultdict(collections.OrderedDict)
+        self.singletons = {}
+        self.tokens = {}
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self._thread = None
+        self._cert_dir = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def provider(self):
+        return dict(f5_hostname='127.0.0.1', f5_port=self.port, f5_username=self.username,
+                    f5_password=self.password, f5_verify=False)
+
+    def populate(self, path, count, partition='Common', **fields):
+        """Add count resources (named 'resource-<i>') to a collection."""
+        for i in range(count):
+            resource = dict(fields, name='resource-{0}'.format(i), partition=partition)
+            self.add_resource(path, resource)
+
+    def add_resource(self, path, resource):
+        with self.lock:
+            return self._store_resource(path.rstrip('/'), resource)
+
+    def _store_resource(self, path, resource):
+        resource = dict(resource)
+        res_id = _get_resource_id(resource)
+        resource.update(kind=_get_kind(path), generation=1,
+                        selfLink='https://localhost{0}/{1}?ver={2}'.format(path, res_id, VERSION))
+        if 'partition' in resource:
+            resource['fullPath'] = res_id.replace('~', '/')
+        self.collections[path][res_id] = resource
+        return resource
+
+    def add_singleton(self, path, resource):
+        """Add an unnamed resource (eg /mgmt/tm/sys/global-settings)."""
+        path = path.rstrip('/')
+        resource = dict(resource, kind=_get_kind(path), generation=1,
+                        selfLink='https://localhost{0}?ver={1}'.format(path, VERSION))
+        self.singletons[path] = resource
+
+    def reset_counts(self):
+        with self.lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+        return counts
+
+    def start(self):
+        self._cert_dir = tempfile.mkdtemp()
+        cert_file = os.path.join(self._cert_dir, 'cert.pem')
+        key_file = os.path.join(self._cert_dir, 'key.pem')
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                               '-subj', '/CN=localhost', '-keyout', key_file, '-out', cert_file],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._cert_dir is not None:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+
+
+class F5MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, do not wait for the ACK of the headers
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        query = dict(parse_qsl(url.query))
+
+        with server.lock:
+            server.counts[method] += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        if path == '/mgmt/shared/authn/login' and method == 'POST':
+            return self._login(body or {})
+        if not self._is_authenticated():
+            return self._send(401, {'code': 401, 'message': 'Authorization failed'})
+
+        if path == '/mgmt/tm/sys':
+            return self._send(200, {'kind': 'tm:sys:syscollectionstate',
+                                    'selfLink': 'https://localhost/mgmt/tm/sys?ver={0}'.format(VERSION),
+                                    'items': []})
+
+        select = set(query['$select'].split(',')) if '$select' in query else None
+
+        with server.lock:
+            if path in server.singletons:
+                return self._singleton(method, path, body, select)
+
+            collection_path, _, res_id = path.rpartition('/')
+            if res_id.startswith('~') or (collection_path in server.collections and method != 'POST'
+                                          and res_id in server.collections[collection_path]):
+                return self._resource(method, collection_path, res_id, body, select)
+            return self._collection(method, path, body, query, select)
+
+    def _login(self, body):
+        server = self.server
+        if body.get('username') != server.username or body.get('password') != server.password:
+            return self._send(401, {'code': 401, 'message': 'Authentication failed.'})
+        token = uuid.uuid4().hex
+        with server.lock:
+            server.tokens[token] = time.time() + TOKEN_TIMEOUT
+        return self._send(200, {'token': {'token': token, 'timeout': TOKEN_TIMEOUT,
+                                          'lastUpdateMicros': int(time.time() * 1000000)}})
+
+    def _is_authenticated(self):
+        server = self.server
+        token = self.headers.get('X-F5-Auth-Token')
+        if token is not None:
+            return server.tokens.get(token, 0) > time.time()
+        auth = self.headers.get('Authorization', '')
+        if auth.startswith('Basic '):
+            return b64decode(auth[6:]).decode('utf-8') == '{0}:{1}'.format(server.username, server.password)
+        return False
+
+    def _singleton(self, method, path, body, select):
+        resource = self.server.singletons[path]
+        if method == 'GET':
+            return self._send(200, _project(resource, select))
+        if method in ('PATCH', 'PUT'):
+            resource.update(body or {})
+            resource['generation'] += 1
+            return self._send(200, resource)
+        return self._send(405, {'code': 405, 'message': 'Method not allowed'})
+
+    def _resource(self, method, collection_path, res_id, body, select):
+        items = self.server.collections.get(collection_path, {})
+        resource = items.get(res_id)
+        if resource is None:
+            return self._send(404, {'code': 404, 'message': 'Object not found: {0}'.format(res_id)})
+
+        if method == 'GET':
+            return self._send(200, _project(resource, select))
+        if method == 'PATCH':
+            resource.update(body or {})
+        elif method == 'PUT':
+            identity = dict((k, resource[k]) for k in ('name', 'partition', 'subPath', 'fullPath', 'kind',
+                                                       'selfLink', 'generation') if k in resource)
+            resource.clear()
+            resource.update(body or {}, **identity)
+        elif method == 'DELETE':
+            del items[res_id]
+            return self._send(200, None)
+        else:
+            return self._send(405, {'code': 405, 'message': 'Method not allowed'})
+        resource['generation'] += 1
+        return self._send(200, resource)
+
+    def _collection(self, method, path, body, query, select):
+        server = self.server
+        if method == 'GET':
+            items = list(server.collections.get(path, {}).values())
+            skip = int(query.get('$skip', 0))
+            top = int(query.get('$top', len(items) or 1))
+            page = [_project(item, select) for item in items[skip:skip + top]]
+            return self._send(200, {'kind': _get_kind(path).replace('state', 'collectionstate'),
+                                    'selfLink': 'https://localhost{0}?ver={1}'.format(path, VERSION),
+                                    'items': page, 'totalItems': len(items)})
+        if method == 'POST':
+            if not body or 'name' not in body:
+                return self._send(400, {'code': 400, 'message': 'The name is required'})
+            if _get_resource_id(body) in server.collections.get(path, {}):
+                return self._send(409, {'code': 409, 'message': 'The object already exists'})
+            return self._send(200, server._store_resource(path, body))
+        return self._send(405, {'code': 405, 'message': 'Method not allowed'})
+
+    def _send(self, status, data):
+        payload = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--pools', type=int, default=0, help='number of pools to create at start')
+    args = parser.parse_args()
+
+    server = F5MockServer(port=args.port, latency=args.latency)
+    server.populate('/mgmt/tm/ltm/pool', args.pools)
+    server.add_singleton('/mgmt/tm/sys/global-settings', {'hostname': 'bigip1', 'guiSetup': 'enabled'})
+    server.start()
+    print('Listening on https://127.0.0.1:{0} (admin/admin)'.format(server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()